@@ -0,0 +1,88 @@
+import heapq
+from bisect import bisect_left, insort
+from typing import Any, Dict, List, Optional
+
+
+class _Term:
+    __slots__ = ("text", "kind", "weight", "track")
+
+    def __init__(self, text: str, kind: str, weight: float, track: Optional[dict]):
+        self.text = text
+        self.kind = kind
+        self.weight = weight
+        self.track = track
+
+
+class AutocompleteIndex:
+    """
+    In-process prefix index over titles, artists and albums.
+
+    Keys are kept in a sorted list so a prefix lookup is one bisect plus a
+    short scan. Each key carries a popularity weight that grows every time
+    the term is seen again. When the index grows past `max_terms`, weights
+    are halved (so old popularity fades) and the lightest tenth of terms is
+    dropped.
+
+    Callers pass keys already normalized (case-folded, whitespace
+    collapsed) so they match however the caller normalizes queries.
+    """
+
+    def __init__(self, max_terms: int = 50000, max_scan: int = 512):
+        self.max_terms = max_terms
+        self.max_scan = max_scan
+        self._keys: List[str] = []
+        self._terms: Dict[str, _Term] = {}
+        self.lookups = 0
+        self.hits = 0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key: str, text: str, kind: str, weight: float = 1.0,
+            track: Optional[dict] = None):
+        if not key:
+            return
+        term = self._terms.get(key)
+        if term is None:
+            self._terms[key] = _Term(text, kind, weight, track)
+            insort(self._keys, key)
+            if len(self._keys) > self.max_terms:
+                self._compact()
+        else:
+            term.weight += weight
+            if track is not None:
+                term.track = track
+
+    def suggest(self, prefix: str, limit: int = 5) -> List[_Term]:
+        """Most popular terms starting with `prefix`, heaviest first"""
+        self.lookups += 1
+        if not prefix:
+            return []
+
+        start = bisect_left(self._keys, prefix)
+        candidates = []
+        for key in self._keys[start:start + self.max_scan]:
+            if not key.startswith(prefix):
+                break
+            candidates.append(self._terms[key])
+
+        if candidates:
+            self.hits += 1
+        return heapq.nlargest(limit, candidates, key=lambda t: t.weight)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "terms": len(self._keys),
+            "max_terms": self.max_terms,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_ratio": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+        }
+
+    def _compact(self):
+        for term in self._terms.values():
+            term.weight /= 2
+        drop = max(1, len(self._keys) // 10)
+        for key in heapq.nsmallest(drop, self._terms, key=lambda k: self._terms[k].weight):
+            del self._terms[key]
+        self._keys = sorted(self._terms)
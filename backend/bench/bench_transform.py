@@ -0,0 +1,147 @@
+"""
+Microbenchmark: per-request CPU spent turning an upstream /search payload
+into the JSON body of /search.
+
+"before" is the original per-track transform_track (nested dicts, try/except
+around every track) followed by FastAPI's default jsonable_encoder + json
+serialization; "after" is models.transform_tracks plus orjson, which is what
+the JSONResponse handlers now do.
+
+    cd backend && python bench/bench_transform.py [payload.json] [iterations]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import orjson  # noqa: E402
+
+from models import transform_tracks  # noqa: E402
+
+try:
+    from fastapi.encoders import jsonable_encoder
+except ImportError:
+    def jsonable_encoder(value):
+        return value
+
+
+def legacy_transform_track(amz_track: dict) -> dict:
+    """transform_track as it was before the Track model"""
+    try:
+        artists = []
+        if isinstance(amz_track.get("artists"), list):
+            for artist in amz_track.get("artists", []):
+                if isinstance(artist, dict):
+                    artists.append({
+                        "name": str(artist.get("name", "Unknown")),
+                        "id": str(artist.get("id", "") or artist.get("asin", ""))
+                    })
+                elif isinstance(artist, str):
+                    artists.append({"name": artist, "id": ""})
+        elif isinstance(amz_track.get("artist"), dict):
+            artist_obj = amz_track.get("artist")
+            artists.append({
+                "name": str(artist_obj.get("name", "Unknown")),
+                "id": str(artist_obj.get("id", "") or artist_obj.get("asin", ""))
+            })
+        elif isinstance(amz_track.get("artist"), str):
+            artists.append({"name": amz_track.get("artist"), "id": ""})
+
+        if not artists:
+            artists = [{"name": "Unknown Artist", "id": ""}]
+
+        album_data = amz_track.get("album", {})
+        if isinstance(album_data, dict):
+            album = {
+                "name": str(album_data.get("title", "") or album_data.get("name", "") or "Unknown Album"),
+                "id": str(album_data.get("id", "") or album_data.get("asin", "") or "")
+            }
+        elif isinstance(album_data, str):
+            album = {"name": album_data, "id": ""}
+        else:
+            album = {"name": "Unknown Album", "id": ""}
+
+        thumbnails = []
+        cover_url = (
+            amz_track.get("cover") or
+            amz_track.get("image") or
+            amz_track.get("artwork") or
+            amz_track.get("thumbnail")
+        )
+        if cover_url:
+            thumbnails = [{"url": str(cover_url), "width": 500, "height": 500}]
+
+        track_id = amz_track.get("id") or amz_track.get("trackId") or amz_track.get("asin") or ""
+        title = amz_track.get("title") or amz_track.get("name") or "Unknown Title"
+
+        duration = amz_track.get("duration") or amz_track.get("durationSeconds")
+        if duration:
+            try:
+                duration = int(duration)
+            except (ValueError, TypeError):
+                duration = None
+
+        return {
+            "videoId": str(track_id),
+            "title": str(title),
+            "artists": artists,
+            "album": album,
+            "duration": duration,
+            "duration_seconds": duration,
+            "thumbnails": thumbnails,
+            "isExplicit": bool(amz_track.get("explicit", False)),
+            "year": amz_track.get("year") or amz_track.get("releaseYear") or None
+        }
+    except Exception:
+        return {"videoId": "unknown"}
+
+
+def before(raw_tracks: list) -> bytes:
+    transformed = []
+    for track in raw_tracks[:20]:
+        try:
+            t = legacy_transform_track(track)
+            if t.get("videoId") and t.get("videoId") != "unknown":
+                transformed.append(t)
+        except Exception:
+            continue
+    return json.dumps(jsonable_encoder(transformed), ensure_ascii=False).encode()
+
+
+def after(raw_tracks: list) -> bytes:
+    return orjson.dumps(transform_tracks(raw_tracks, 20))
+
+
+def measure(fn, raw_tracks: list, iterations: int) -> float:
+    """Mean CPU microseconds per call"""
+    for _ in range(min(iterations, 200)):
+        fn(raw_tracks)
+    start = time.process_time()
+    for _ in range(iterations):
+        fn(raw_tracks)
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(here, "payloads", "search.json")
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    with open(path, "rb") as f:
+        raw_tracks = orjson.loads(f.read())["tracks"]
+
+    assert orjson.loads(before(raw_tracks)) == orjson.loads(after(raw_tracks)), "outputs differ"
+
+    old = measure(before, raw_tracks, iterations)
+    new = measure(after, raw_tracks, iterations)
+    print(f"payload: {os.path.basename(path)} ({len(raw_tracks)} tracks, first 20 transformed)")
+    print(f"encoder: {'fastapi jsonable_encoder + json' if jsonable_encoder.__module__ != __name__ else 'json (fastapi not installed)'}")
+    print(f"before: {old:8.1f} us/request")
+    print(f"after:  {new:8.1f} us/request")
+    print(f"speedup: {old / new:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
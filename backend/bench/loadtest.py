@@ -0,0 +1,270 @@
+"""
+Load-test scenarios against the backend, with the mock upstream behind it.
+
+For each scenario a fresh mock upstream and backend are started (cold
+caches, counters at zero), simulated users run for `--duration` seconds,
+and the run reports requests/s, p50/p95/p99 latency, errors and the
+number of upstream calls the backend made.
+
+    cd backend && python bench/loadtest.py                      # every scenario
+    cd backend && python bench/loadtest.py radio --users 100 --latency 0.15 --error-rate 0.05
+    cd backend && python bench/loadtest.py --json results.json  # for comparing runs
+    cd backend && STREAM_COUNTRIES=US,AU,JP python bench/loadtest.py radio --region-lock 0.3
+
+Scenarios:
+    charts-burst   homepage loads: every user hits /charts at once, repeatedly
+    search-typing  users type queries: /suggestions per keystroke, then /search
+    radio          playback: /related?prefetch=3 then /stream for the next track
+
+Runs are seeded (`--seed`), so the same command issues the same requests.
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+import orjson
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(HERE)
+
+QUERIES = [
+    "sza", "the weeknd", "taylor swift", "drake", "billie eilish", "bad bunny",
+    "dua lipa", "kendrick lamar", "olivia rodrigo", "arctic monkeys", "blinding lights",
+    "anti hero", "flowers", "kill bill", "as it was", "espresso",
+]
+
+
+class Recorder:
+    """Latencies and failures, grouped by route"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def get(self, client, route: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await client.get(url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[route] += 1
+            self.latencies[route].append(time.perf_counter() - started)
+            return None
+        self.latencies[route].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            self.errors[route] += 1
+        return response
+
+
+async def charts_burst(client, rec: Recorder, user: int, rng: random.Random, stop: float):
+    while time.monotonic() < stop:
+        await rec.get(client, "/charts", "/charts")
+        await asyncio.sleep(rng.uniform(0.5, 1.5))
+
+
+async def search_typing(client, rec: Recorder, user: int, rng: random.Random, stop: float):
+    while time.monotonic() < stop:
+        query = rng.choice(QUERIES)
+        for end in range(2, len(query) + 1):
+            await rec.get(client, "/suggestions", "/suggestions", params={"q": query[:end]})
+            await asyncio.sleep(rng.uniform(0.06, 0.18))  # keystroke interval
+        await rec.get(client, "/search", "/search", params={"q": query})
+        await asyncio.sleep(rng.uniform(0.5, 2.0))
+
+
+async def radio(client, rec: Recorder, user: int, rng: random.Random, stop: float):
+    response = await rec.get(client, "/search", "/search", params={"q": rng.choice(QUERIES)})
+    tracks = response.json() if response is not None and response.status_code == 200 else []
+    if not tracks:
+        return
+    current = tracks[0]["videoId"]
+    await rec.get(client, "/stream/{video_id}", f"/stream/{current}")
+
+    while time.monotonic() < stop:
+        await asyncio.sleep(rng.uniform(1.0, 3.0))  # a (very short) song
+        response = await rec.get(client, "/related/{video_id}", f"/related/{current}", params={"prefetch": 3})
+        related = response.json() if response is not None and response.status_code == 200 else []
+        if related:
+            current = related[0]["videoId"] if rng.random() < 0.7 else rng.choice(related)["videoId"]
+        await rec.get(client, "/stream/{video_id}", f"/stream/{current}")
+
+
+SCENARIOS = {
+    "charts-burst": charts_burst,
+    "search-typing": search_typing,
+    "radio": radio,
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start_servers(args) -> tuple:
+    """Fresh mock upstream + backend; returns (processes, backend_url, mock_url)"""
+    mock_port, backend_port = free_port(), free_port()
+    mock = subprocess.Popen([
+        sys.executable, os.path.join(HERE, "mock_upstream.py"), "--port", str(mock_port),
+        "--latency", str(args.latency), "--jitter", str(args.jitter),
+        "--error-rate", str(args.error_rate), "--region-lock", str(args.region_lock), "--seed", str(args.seed),
+    ])
+    mock_url = f"http://127.0.0.1:{mock_port}"
+
+    env = dict(os.environ)
+    env.update({
+        "AMAZON_MUSIC_API_URL": mock_url,
+        "LOG_LEVEL": "WARNING",
+        "CHART_COUNTRIES": "",  # no startup warm-up: every scenario starts cold
+    })
+    backend = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+        "--port", str(backend_port), "--workers", str(args.workers), "--log-level", "warning",
+    ], cwd=BACKEND_DIR, env=env)
+    backend_url = f"http://127.0.0.1:{backend_port}"
+
+    procs = [backend, mock]
+    try:
+        wait_ready(f"{mock_url}/__calls")
+        wait_ready(f"{backend_url}/info")
+    except Exception:
+        stop_servers(procs)
+        raise
+    return procs, backend_url, mock_url
+
+
+def stop_servers(procs: list):
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+class _UserClient:
+    """The shared connection pool, tagged with one simulated user's id"""
+
+    def __init__(self, client: httpx.AsyncClient, user: int):
+        self.client = client
+        self.headers = {"X-Client-Id": f"user-{user}"}
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.client.get(url, headers=self.headers, **kwargs)
+
+
+async def run_scenario(name: str, args) -> dict:
+    procs, backend_url, mock_url = await asyncio.to_thread(start_servers, args)
+    try:
+        rec = Recorder()
+        limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+        async with httpx.AsyncClient(base_url=backend_url, limits=limits, timeout=60.0) as client:
+            stop = time.monotonic() + args.duration
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                SCENARIOS[name](
+                    _UserClient(client, user), rec, user,
+                    random.Random(f"{args.seed}:{name}:{user}"), stop,
+                )
+                for user in range(args.users)
+            ))
+            elapsed = time.perf_counter() - started
+        upstream = httpx.get(f"{mock_url}/__calls").json()
+    finally:
+        await asyncio.to_thread(stop_servers, procs)
+
+    all_latencies = [l for values in rec.latencies.values() for l in values]
+    result = summarize(all_latencies, sum(rec.errors.values()), elapsed)
+    result["routes"] = {
+        route: summarize(values, rec.errors[route], elapsed)
+        for route, values in sorted(rec.latencies.items())
+    }
+    result["upstream_calls"] = sum(upstream.values())
+    result["upstream"] = dict(sorted(upstream.items()))
+    result["upstream_per_request"] = round(result["upstream_calls"] / result["requests"], 3) if result["requests"] else 0.0
+    return result
+
+
+def print_report(name: str, result: dict):
+    print(f"\n== {name} ==")
+    print(f"{'route':<24}{'requests':>9}{'errors':>8}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    rows = list(result["routes"].items()) + [("total", result)]
+    for route, r in rows:
+        print(f"{route:<24}{r['requests']:>9}{r['errors']:>8}{r['rps']:>9}"
+              f"{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}")
+    calls = ", ".join(f"{path}: {n}" for path, n in result["upstream"].items()) or "none"
+    print(f"upstream calls: {result['upstream_calls']} ({result['upstream_per_request']}/request) - {calls}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Backend load-test scenarios")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario",
+                        help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--users", type=int, default=50, help="concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per scenario")
+    parser.add_argument("--workers", type=int, default=1, help="backend uvicorn workers")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock upstream mean latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.02, help="mock upstream latency jitter (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls that 503")
+    parser.add_argument("--region-lock", type=float, default=0.0,
+                        help="fraction of tracks the mock streams in one country only")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    results = {}
+    for name in args.scenarios or list(SCENARIOS):
+        results[name] = await run_scenario(name, args)
+        print_report(name, results[name])
+
+    if args.json:
+        with open(args.json, "wb") as f:
+            f.write(orjson.dumps({"args": vars(args), "results": results}, option=orjson.OPT_INDENT_2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,192 @@
+"""
+Mock Amazon Music API for benchmarks.
+
+Replays the payloads in bench/payloads for /search, /track, /artist and
+/stream_urls. Track ids are rewritten deterministically from the request
+(query or id), so different queries return different tracks and every run
+sees the same data. Latency and errors can be injected, and a fraction
+of tracks can be made streamable in one country only (404 elsewhere):
+
+    cd backend && python bench/mock_upstream.py --port 9100 --latency 0.08 --jitter 0.04 --error-rate 0.02
+    cd backend && python bench/mock_upstream.py --region-lock 0.3
+
+Control endpoints (not part of the real API):
+    GET  /__calls   upstream calls served, per path and status
+    POST /__reset   zero the counters
+    POST /__config  {"latency": .., "jitter": .., "error_rate": .., "region_lock": ..} at runtime
+"""
+import argparse
+import asyncio
+import copy
+import os
+import random
+import time
+import zlib
+from collections import Counter
+
+import orjson
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+COUNTRIES = ["US", "AU", "JP"]
+ARTISTS = [
+    "SZA", "The Weeknd", "Taylor Swift", "Drake", "Billie Eilish", "Bad Bunny",
+    "Dua Lipa", "Kendrick Lamar", "Olivia Rodrigo", "Arctic Monkeys", "Rosalia", "Fred again..",
+]
+
+config = {"latency": 0.05, "jitter": 0.02, "error_rate": 0.0, "region_lock": 0.0}
+calls: Counter = Counter()
+rng = random.Random(0)
+
+
+def load(name: str) -> dict:
+    with open(os.path.join(HERE, "payloads", f"{name}.json"), "rb") as f:
+        return orjson.loads(f.read())
+
+
+PAYLOADS = {name: load(name) for name in ("search", "track", "artist", "stream_urls")}
+
+
+def asin(seed: str, i: int = 0) -> str:
+    return f"B{zlib.crc32(f'{seed}:{i}'.encode()) % 10 ** 9:09d}"
+
+
+def artist_for(track_id: str) -> str:
+    return ARTISTS[zlib.crc32(track_id.encode()) % len(ARTISTS)]
+
+
+def set_artist(track: dict, name: str):
+    """Rename the primary artist, whichever shape the payload uses"""
+    artists = track.get("artists")
+    if artists and isinstance(artists[0], dict):
+        artists[0]["name"] = name
+    elif artists:
+        artists[0] = name
+    elif isinstance(track.get("artist"), dict):
+        track["artist"]["name"] = name
+    else:
+        track["artist"] = name
+
+
+def available_in(track_id: str, country: str) -> bool:
+    """Region-locked tracks stream in a single country, picked from the id"""
+    h = zlib.crc32(f"region:{track_id}".encode())
+    if h % 1000 >= config["region_lock"] * 1000:
+        return True
+    return country.upper() == COUNTRIES[h % len(COUNTRIES)]
+
+
+def search_payload(query: str) -> dict:
+    payload = copy.deepcopy(PAYLOADS["search"])
+    for i, track in enumerate(payload["tracks"]):
+        track_id = asin(query, i)
+        track["asin"] = track_id
+        track["title"] = f"Track {track_id}"
+        set_artist(track, artist_for(track_id))
+    return payload
+
+
+def track_payload(track_id: str) -> dict:
+    payload = copy.deepcopy(PAYLOADS["track"])
+    track = payload["track"]
+    track["asin"] = track_id
+    track["title"] = f"Track {track_id}"
+    set_artist(track, artist_for(track_id))
+    return payload
+
+
+def artist_payload(artist_id: str) -> dict:
+    payload = copy.deepcopy(PAYLOADS["artist"])
+    payload["artist"]["asin"] = artist_id
+    payload["artist"]["name"] = ARTISTS[zlib.crc32(artist_id.encode()) % len(ARTISTS)]
+    return payload
+
+
+def stream_payload(track_id: str) -> dict:
+    payload = copy.deepcopy(PAYLOADS["stream_urls"])
+    expires = int(time.time()) + 3600
+    payload["asin"] = track_id
+    payload["urls"] = {
+        quality: url.replace(PAYLOADS["stream_urls"]["asin"], track_id).replace("Expires=0", f"Expires={expires}")
+        for quality, url in payload["urls"].items()
+    }
+    return payload
+
+
+app = FastAPI(title="Mock Amazon Music API")
+
+
+async def respond(path: str, build, available: bool = True) -> Response:
+    delay = config["latency"] + rng.uniform(-config["jitter"], config["jitter"])
+    if delay > 0:
+        await asyncio.sleep(delay)
+    if rng.random() < config["error_rate"]:
+        calls[f"{path} 503"] += 1
+        return Response(b'{"error":"injected"}', status_code=503, media_type="application/json")
+    if not available:
+        calls[f"{path} 404"] += 1
+        return Response(b'{"error":"not available in this region"}', status_code=404, media_type="application/json")
+    calls[f"{path} 200"] += 1
+    return Response(orjson.dumps(build()), media_type="application/json")
+
+
+@app.get("/search")
+async def search(query: str = ""):
+    return await respond("/search", lambda: search_payload(query))
+
+
+@app.get("/track")
+async def track(id: str):
+    return await respond("/track", lambda: track_payload(id))
+
+
+@app.get("/artist")
+async def artist(id: str):
+    return await respond("/artist", lambda: artist_payload(id))
+
+
+@app.get("/stream_urls")
+async def stream_urls(id: str, country: str = "US"):
+    return await respond("/stream_urls", lambda: stream_payload(id), available_in(id, country))
+
+
+@app.get("/__calls")
+def get_calls():
+    return dict(calls)
+
+
+@app.post("/__reset")
+def reset():
+    calls.clear()
+    return {"ok": True}
+
+
+@app.post("/__config")
+async def set_config(request: Request):
+    updates = await request.json()
+    config.update({k: float(v) for k, v in updates.items() if k in config})
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=config["latency"], help="mean response delay (s)")
+    parser.add_argument("--jitter", type=float, default=config["jitter"], help="uniform +/- delay (s)")
+    parser.add_argument("--error-rate", type=float, default=config["error_rate"], help="fraction answered 503")
+    parser.add_argument("--region-lock", type=float, default=config["region_lock"],
+                        help="fraction of tracks streamable in one country only")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config.update(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, region_lock=args.region_lock)
+    rng.seed(args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
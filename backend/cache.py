@@ -0,0 +1,503 @@
+import asyncio
+import logging
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import orjson
+
+log = logging.getLogger("khokho.cache")
+
+
+def estimate_size(value: Any) -> int:
+    """Rough deep size in bytes of a JSON-like value"""
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_size(k) + estimate_size(v) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    slots = getattr(type(value), "__slots__", None)
+    if slots:
+        return sys.getsizeof(value) + sum(estimate_size(getattr(value, s)) for s in slots)
+    return sys.getsizeof(value)
+
+
+class _Entry:
+    __slots__ = ("value", "expires", "size")
+
+    def __init__(self, value: Any, expires: float, size: int):
+        self.value = value
+        self.expires = expires
+        self.size = size
+
+
+class TTLCache:
+    """
+    Bounded LRU cache with per-entry expiry.
+
+    Entries are evicted least-recently-used first once either `max_entries`
+    or `max_bytes` (0 disables the byte budget) is exceeded. Expired entries
+    are dropped on access and by `sweep()`, which `run_sweeper()` calls
+    periodically so cold keys don't linger until the next lookup.
+
+    With `stale_ttl`, expired entries are kept that much longer so
+    `get_stale()` can serve them while upstream is unavailable.
+    """
+
+    def __init__(self, name: str, max_entries: int = 10000, max_bytes: int = 0,
+                 default_ttl: float = 3600, stale_ttl: float = 0):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self._data: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: str) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and time.time() < entry.expires
+
+    def get(self, key: str, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        now = time.time()
+        if now >= entry.expires:
+            if now >= entry.expires + self.stale_ttl:
+                self._remove(key)
+                self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def get_stale(self, key: str, default: Any = None) -> Any:
+        """Value for `key` even if expired, as long as it is within `stale_ttl`"""
+        entry = self._data.get(key)
+        if entry is None or time.time() >= entry.expires + self.stale_ttl:
+            return default
+        self.stale_hits += 1
+        return entry.value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        if key in self._data:
+            self._remove(key)
+        size = estimate_size(value) if self.max_bytes else 0
+        self._data[key] = _Entry(value, time.time() + ttl, size)
+        self._bytes += size
+        self._evict()
+
+    def delete(self, key: str) -> bool:
+        if key in self._data:
+            self._remove(key)
+            return True
+        return False
+
+    def clear(self):
+        self._data.clear()
+        self._bytes = 0
+
+    def ttl(self, key: str) -> Optional[float]:
+        """Seconds left before `key` expires, or None if absent"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        return max(0.0, entry.expires - time.time())
+
+    def entries(self) -> List[Tuple[str, Any, float]]:
+        """(key, value, expires) for every entry still servable, least recent first"""
+        cutoff = time.time() - self.stale_ttl
+        return [(k, e.value, e.expires) for k, e in self._data.items() if e.expires > cutoff]
+
+    def restore(self, key: str, value: Any, expires: float) -> bool:
+        """
+        Add an entry with an absolute expiry as the least recently used one,
+        unless the key is already present or the entry is past serving.
+        """
+        if key in self._data or time.time() >= expires + self.stale_ttl:
+            return False
+        size = estimate_size(value) if self.max_bytes else 0
+        self._data[key] = _Entry(value, expires, size)
+        self._data.move_to_end(key, last=False)
+        self._bytes += size
+        self._evict()
+        return key in self._data
+
+    def sweep(self) -> int:
+        """Drop every expired entry, returning how many were removed"""
+        now = time.time()
+        expired = [k for k, e in self._data.items() if now >= e.expires + self.stale_ttl]
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+        return len(expired)
+
+    async def run_sweeper(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "stale_hits": self.stale_hits,
+        }
+
+    def _remove(self, key: str):
+        entry = self._data.pop(key)
+        self._bytes -= entry.size
+
+    def _evict(self):
+        while self._data and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes and self._bytes > self.max_bytes)
+        ):
+            _, entry = self._data.popitem(last=False)
+            self._bytes -= entry.size
+            self.evictions += 1
+
+
+class CacheBackend:
+    """
+    A cache shared between worker processes.
+
+    Values are stored as `[expires_at, value]` so a reader can give its
+    local copy the same remaining lifetime.
+    """
+
+    name = "none"
+
+    async def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any, ttl: float):
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def sweep(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Cache stored in a SQLite file, shared by every worker on the host.
+
+    All access goes through one worker thread per process; WAL mode lets
+    several processes read while one writes.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-cache")
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _get(self, key: str):
+        row = self._connect().execute(
+            "SELECT value, expires FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return row[1], orjson.loads(row[0])
+
+    def _set(self, key: str, blob: bytes, expires: float):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, blob, expires),
+        )
+
+    def _delete(self, key: str):
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def _sweep(self):
+        self._connect().execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        return await self._run(self._get, key)
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await self._run(self._set, key, orjson.dumps(value), time.time() + ttl)
+
+    async def delete(self, key: str):
+        await self._run(self._delete, key)
+
+    async def sweep(self):
+        await self._run(self._sweep)
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
+
+
+class RedisError(Exception):
+    pass
+
+
+class _RedisConnection:
+    """Minimal RESP2 client: enough for GET/SET/DEL against any Redis-protocol server"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    async def command(self, *args) -> Any:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode()
+            elif not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        self.writer.write(b"".join(out))
+        await self.writer.drain()
+        return await self._read_reply()
+
+    async def _read_reply(self) -> Any:
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload
+        if kind == b"-":
+            raise RedisError(payload.decode(errors="replace"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self.reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(payload)
+            if count < 0:
+                return None
+            return [await self._read_reply() for _ in range(count)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    def close(self):
+        self.writer.close()
+
+
+class RedisBackend(CacheBackend):
+    """
+    Cache stored in Redis (or anything speaking the Redis protocol),
+    shared by every worker and replica pointed at it.
+
+    Connections are pooled; a connection that errors or exceeds `timeout`
+    is dropped rather than returned to the pool.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, pool_size: int = 10, timeout: float = 1.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 6379
+        self.password = parts.password
+        self.db = int(parts.path.lstrip("/") or 0)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._idle: List[_RedisConnection] = []
+        self._slots = asyncio.Semaphore(pool_size)
+
+    async def _open(self) -> _RedisConnection:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout
+        )
+        conn = _RedisConnection(reader, writer)
+        if self.password:
+            await conn.command("AUTH", self.password)
+        if self.db:
+            await conn.command("SELECT", self.db)
+        return conn
+
+    async def _command(self, *args) -> Any:
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else await self._open()
+            try:
+                reply = await asyncio.wait_for(conn.command(*args), self.timeout)
+            except BaseException:
+                conn.close()
+                raise
+            self._idle.append(conn)
+            return reply
+
+    async def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        blob = await self._command("GET", key)
+        if blob is None:
+            return None
+        expires, value = orjson.loads(blob)
+        return expires, value
+
+    async def set(self, key: str, value: Any, ttl: float):
+        expires = time.time() + ttl
+        await self._command("SET", key, orjson.dumps([expires, value]), "PX", max(1, int(ttl * 1000)))
+
+    async def delete(self, key: str):
+        await self._command("DEL", key)
+
+    async def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+
+def create_backend(url: str) -> Optional[CacheBackend]:
+    """
+    Build the shared backend named by CACHE_BACKEND.
+
+    "memory" (the default) means no shared tier; "sqlite:///cache.db"
+    (relative) or "sqlite:////var/cache/khokho.db" (absolute) and
+    "redis://[:password@]host:port/db" select the shared backends.
+    """
+    if not url or url == "memory":
+        return None
+    if url.startswith("sqlite:///"):
+        # sqlite:///relative.db or sqlite:////absolute/path.db
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if url.startswith("redis://"):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported CACHE_BACKEND: {url}")
+
+
+class SharedCache:
+    """
+    A TTLCache backed by an optional shared backend.
+
+    Reads hit the local LRU first and fall back to the shared backend,
+    copying what they find into the local tier for its remaining lifetime.
+    Writes go to both. Backend failures are logged and treated as misses,
+    so a dead Redis degrades to per-process caching. `decode` rebuilds
+    objects (e.g. Track) from the JSON the shared tier returns.
+    """
+
+    def __init__(self, local: TTLCache, backend: Optional[CacheBackend] = None,
+                 decode: Optional[Callable[[Any], Any]] = None):
+        self.local = local
+        self.backend = backend
+        self.decode = decode
+        self.namespace = local.name
+        self.shared_hits = 0
+        self.shared_errors = 0
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        value = self.local.get(key)
+        if value is not None or self.backend is None:
+            return default if value is None else value
+
+        try:
+            found = await self.backend.get(self._key(key))
+        except Exception as e:
+            self.shared_errors += 1
+            log.warning("shared cache read failed", extra={"backend": self.backend.name, "error": repr(e)})
+            return default
+        if found is None:
+            return default
+
+        expires, value = found
+        if self.decode is not None:
+            value = self.decode(value)
+        self.shared_hits += 1
+        self.local.set(key, value, ttl=expires - time.time())
+        return value
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.local.default_ttl if ttl is None else ttl
+        self.local.set(key, value, ttl=ttl)
+        if self.backend is None or ttl <= 0:
+            return
+        try:
+            await self.backend.set(self._key(key), value, ttl)
+        except Exception as e:
+            self.shared_errors += 1
+            log.warning("shared cache write failed", extra={"backend": self.backend.name, "error": repr(e)})
+
+    def get_stale(self, key: str, default: Any = None) -> Any:
+        """Expired-but-recent local value, for serving while upstream is down"""
+        return self.local.get_stale(key, default)
+
+    async def delete(self, key: str):
+        self.local.delete(key)
+        if self.backend is not None:
+            try:
+                await self.backend.delete(self._key(key))
+            except Exception as e:
+                self.shared_errors += 1
+                log.warning("shared cache delete failed", extra={"backend": self.backend.name, "error": repr(e)})
+
+    async def run_sweeper(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            self.local.sweep()
+            if self.backend is not None:
+                try:
+                    await self.backend.sweep()
+                except Exception as e:
+                    self.shared_errors += 1
+                    log.warning("shared cache sweep failed", extra={"backend": self.backend.name, "error": repr(e)})
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.local.stats()
+        stats["backend"] = self.backend.name if self.backend else "memory"
+        stats["shared_hits"] = self.shared_hits
+        stats["shared_errors"] = self.shared_errors
+        return stats
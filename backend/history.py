@@ -0,0 +1,267 @@
+import asyncio
+import base64
+import glob
+import hashlib
+import hmac
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import orjson
+
+log = logging.getLogger("khokho.history")
+
+
+def verify_supabase_token(token: str, secret: str) -> Optional[str]:
+    """
+    User id (`sub`) of a Supabase access token signed with the project's
+    HS256 JWT secret, or None if the signature or expiry doesn't check out.
+    """
+    try:
+        header_b64, payload_b64, signature_b64 = token.split(".")
+        header = orjson.loads(_b64decode(header_b64))
+        payload = orjson.loads(_b64decode(payload_b64))
+        signature = _b64decode(signature_b64)
+    except ValueError:
+        return None
+    if not isinstance(header, dict) or not isinstance(payload, dict) or header.get("alg") != "HS256":
+        return None
+
+    expected = hmac.new(secret.encode(), f"{header_b64}.{payload_b64}".encode(), hashlib.sha256).digest()
+    if not hmac.compare_digest(signature, expected):
+        return None
+    exp = payload.get("exp")
+    if type(exp) not in (int, float) or exp < time.time() or payload.get("role") != "authenticated":
+        return None
+    sub = payload.get("sub")
+    return sub if isinstance(sub, str) and sub else None
+
+
+def _b64decode(data: str) -> bytes:
+    try:
+        return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    except (ValueError, TypeError) as e:
+        raise ValueError(str(e))
+
+
+class HistoryWriter:
+    """
+    Buffers `history` rows and writes them to Supabase in bulk.
+
+    Rows are appended to a write-ahead file before `add()` returns and are
+    flushed as one PostgREST insert per `max_batch` rows, whenever
+    `max_batch` rows are waiting or every `flush_interval` seconds. The
+    write-ahead file is rotated at each flush and deleted once everything
+    in it has been inserted; on startup leftover files are replayed. Each
+    row carries an `event_id`, so a replay after a partial flush doesn't
+    duplicate rows.
+
+    Each process logs to its own file in `wal_dir`; files left behind by
+    processes that are no longer running are claimed and replayed by the
+    next one to start.
+
+    When Supabase is unreachable, flushes back off exponentially and the
+    buffer grows up to `max_buffer` rows, after which `add()` refuses new
+    rows. A batch Supabase rejects as invalid (4xx) is dropped, not retried.
+    """
+
+    def __init__(self, url: str, service_key: str, wal_dir: str,
+                 max_batch: int = 500, flush_interval: float = 2.0,
+                 max_buffer: int = 50000, table: str = "history"):
+        self.endpoint = f"{url.rstrip('/')}/rest/v1/{table}"
+        self.service_key = service_key
+        self.wal_dir = wal_dir
+        self.wal_path = os.path.join(wal_dir, f"{table}-{os.getpid()}.wal")
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer: List[Dict[str, Any]] = []
+        self._wal_fd: Optional[int] = None
+        self._flushed_files: List[str] = []  # rotated WAL files not yet fully inserted
+        self._wake = asyncio.Event()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self.accepted = 0
+        self.rejected = 0
+        self.inserted = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self.replayed = 0
+
+    # Lifecycle
+
+    def start(self):
+        os.makedirs(self.wal_dir, exist_ok=True)
+        for path in self._claim_orphans():
+            rows = self._read_wal(path)
+            self._buffer.extend(rows)
+            self.replayed += len(rows)
+            self._flushed_files.append(path)
+        if self.replayed:
+            log.info("replaying history write-ahead log", extra={"rows": self.replayed})
+        self._open_wal()
+        self._client = httpx.AsyncClient(
+            headers={
+                "apikey": self.service_key,
+                "Authorization": f"Bearer {self.service_key}",
+                "Content-Type": "application/json",
+                "Prefer": "return=minimal,resolution=ignore-duplicates",
+            },
+            timeout=httpx.Timeout(10.0),
+        )
+
+    async def run(self):
+        """Flush loop; cancel it (then call `close()`) to stop"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval + self._backoff)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def close(self):
+        """Last flush attempt; anything left stays in the write-ahead log"""
+        try:
+            await self.flush(force=True)
+        finally:
+            if self._client is not None:
+                await self._client.aclose()
+            if self._wal_fd is not None:
+                os.fsync(self._wal_fd)
+                os.close(self._wal_fd)
+                self._wal_fd = None
+
+    # Ingestion
+
+    def add(self, rows: List[Dict[str, Any]]) -> bool:
+        """Buffer rows for insertion; False if the buffer is full"""
+        if len(self._buffer) + len(rows) > self.max_buffer:
+            self.rejected += len(rows)
+            return False
+        # A small append to the page cache; fsync is batched into flush()
+        os.write(self._wal_fd, b"".join(orjson.dumps(row) + b"\n" for row in rows))
+        self._buffer.extend(rows)
+        self.accepted += len(rows)
+        if len(self._buffer) >= self.max_batch:
+            self._wake.set()
+        return True
+
+    async def flush(self, force: bool = False):
+        if not self._buffer or self._client is None:
+            return
+        if not force and time.monotonic() < self._retry_at:
+            return  # backing off; a full buffer doesn't hurry the retry
+
+        # New rows go to a fresh file while this one is being inserted
+        rotated = f"{self.wal_path}.{time.time_ns()}"
+        fd = self._wal_fd
+        os.rename(self.wal_path, rotated)
+        self._open_wal()
+        await asyncio.to_thread(_fsync_close, fd)
+        self._flushed_files.append(rotated)
+
+        rows, self._buffer = self._buffer, []
+        for start in range(0, len(rows), self.max_batch):
+            batch = rows[start:start + self.max_batch]
+            try:
+                response = await self._client.post(
+                    self.endpoint, params={"on_conflict": "event_id"}, content=orjson.dumps(batch)
+                )
+                response.raise_for_status()
+            except httpx.HTTPStatusError as e:
+                if 400 <= e.response.status_code < 500 and e.response.status_code not in (408, 429):
+                    self.dropped += len(batch)
+                    log.error("history batch rejected, dropping it", extra={
+                        "rows": len(batch), "status": e.response.status_code, "body": e.response.text[:200],
+                    })
+                    continue
+                self._retry_later(rows[start:], e)
+                return
+            except (httpx.HTTPError, OSError) as e:
+                self._retry_later(rows[start:], e)
+                return
+            self.inserted += len(batch)
+            self.batches += 1
+
+        self._backoff = 0.0
+        # Everything in the rotated files is now in Supabase
+        for path in self._flushed_files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._flushed_files = []
+
+    def _retry_later(self, rows: List[Dict[str, Any]], e: Exception):
+        self.failures += 1
+        self._backoff = min(60.0, max(1.0, self._backoff * 2))
+        self._retry_at = time.monotonic() + self._backoff
+        self._buffer[:0] = rows  # retry before anything newer
+        log.warning("history flush failed", extra={
+            "rows": len(rows), "retry_in": self.flush_interval + self._backoff, "error": repr(e),
+        })
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": len(self._buffer),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "inserted": self.inserted,
+            "batches": self.batches,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "replayed": self.replayed,
+            "backoff": self._backoff,
+        }
+
+    # Write-ahead log
+
+    def _claim_orphans(self) -> List[str]:
+        """Move WAL files of dead processes (or a previous run's) into ours"""
+        claimed = []
+        prefix = os.path.basename(self.wal_path).split("-")[0]
+        for path in sorted(glob.glob(os.path.join(self.wal_dir, f"{prefix}-*.wal*"))):
+            pid = os.path.basename(path)[len(prefix) + 1:].split(".")[0]
+            if pid.isdigit() and int(pid) != os.getpid() and _alive(int(pid)):
+                continue
+            target = f"{self.wal_path}.{time.time_ns()}"
+            try:
+                os.rename(path, target)  # atomic, so only one process wins
+            except OSError:
+                continue
+            claimed.append(target)
+        return claimed
+
+    def _open_wal(self):
+        self._wal_fd = os.open(self.wal_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+
+    @staticmethod
+    def _read_wal(path: str) -> List[Dict[str, Any]]:
+        rows = []
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    rows.append(orjson.loads(line))
+                except orjson.JSONDecodeError:
+                    continue  # torn final line from a crash mid-write
+        return rows
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _fsync_close(fd: int):
+    os.fsync(fd)
+    os.close(fd)
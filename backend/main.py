@@ -1,36 +1,265 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel
 import httpx
+import orjson
 import uvicorn
+import asyncio
+import logging
 import time
 import os
-from typing import Optional, List, Dict, Any
+import re
+import uuid
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Any, AsyncIterator, Union
+from urllib.parse import urlsplit, parse_qs
 
-app = FastAPI(title="Music Streamer Backend")
+from autocomplete import AutocompleteIndex
+from cache import SharedCache, TTLCache, create_backend
+from history import HistoryWriter, verify_supabase_token
+from logs import setup_logging
+from metrics import MetricsMiddleware, Registry
+from models import Track, album_of, transform_album, transform_track, transform_tracks
+from prefetch import Prefetcher
+from recommend import Recommender
+from resilience import CircuitBreaker, ResiliencePolicy, RetryBudget, TokenBucket, UpstreamUnavailable
+from segment_cache import SegmentCache
+from singleflight import SingleFlight
+from snapshot import CacheSnapshot
 
-# CORS Configuration
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "https://lolaaaaa.netlify.app",
-        "http://localhost:3000",
-        "http://localhost:5173",
-        "*"
-    ],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Structured logging; hot-path messages are DEBUG and off by default
+setup_logging(os.getenv("LOG_LEVEL", "INFO"), os.getenv("LOG_FORMAT", "json"))
+log = logging.getLogger("khokho")
 
 # Amazon Music API Configuration
 AMAZON_MUSIC_API = os.getenv("AMAZON_MUSIC_API_URL", "https://amz.dezalty.com")
 AMAZON_AUTH_TOKEN = os.getenv("AMAZON_AUTH_TOKEN", "")
 DEFAULT_COUNTRY = os.getenv("COUNTRY", "US")  # US, AU, or JP
 
+# Upstream HTTP client (one per process, shared by every handler)
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", 100))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", 20))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", 30.0))
+UPSTREAM_POOL_TIMEOUT = float(os.getenv("UPSTREAM_POOL_TIMEOUT", 5.0))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# Per-endpoint upstream timeouts (seconds)
+UPSTREAM_TIMEOUTS = {
+    "search": float(os.getenv("UPSTREAM_TIMEOUT_SEARCH", 20.0)),
+    "charts": float(os.getenv("UPSTREAM_TIMEOUT_CHARTS", 20.0)),
+    "suggestions": float(os.getenv("UPSTREAM_TIMEOUT_SUGGESTIONS", 15.0)),
+    "artist": float(os.getenv("UPSTREAM_TIMEOUT_ARTIST", 15.0)),
+    "related": float(os.getenv("UPSTREAM_TIMEOUT_RELATED", 15.0)),
+    "stream": float(os.getenv("UPSTREAM_TIMEOUT_STREAM", 30.0)),
+}
+
+http_client: Optional[httpx.AsyncClient] = None
+# Audio bytes come from CDN hosts, so they get their own pool without the API token
+audio_client: Optional[httpx.AsyncClient] = None
+upstream_stats = {
+    "requests": 0,
+    "errors": 0,
+    "pool_timeouts": 0,
+    "in_flight": 0,
+    "peak_in_flight": 0,
+}
+upstream_flight = SingleFlight()
+
+# Prometheus metrics, served at /metrics
+metrics = Registry()
+http_requests = metrics.counter(
+    "http_requests_total", "Requests served, by route template, method and status",
+    ("route", "method", "status"))
+http_latency = metrics.histogram(
+    "http_request_duration_seconds", "Time to serve a request, by route template", ("route",))
+http_in_flight = metrics.gauge("http_requests_in_flight", "Requests being served", ("method",))
+upstream_requests = metrics.counter(
+    "upstream_requests_total", "Upstream attempts, by upstream path and status", ("path", "status"))
+upstream_latency = metrics.histogram(
+    "upstream_request_duration_seconds", "Upstream attempt latency, by upstream path", ("path",))
+
+# Upstream resilience, applied per upstream route (/search, /track, ...)
+UPSTREAM_RATE_LIMIT = float(os.getenv("UPSTREAM_RATE_LIMIT", 50))  # requests/s
+UPSTREAM_BURST = float(os.getenv("UPSTREAM_BURST", 100))
+UPSTREAM_MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", 3))
+UPSTREAM_RETRY_BUDGET = float(os.getenv("UPSTREAM_RETRY_BUDGET", 0.2))
+UPSTREAM_HEDGE_DELAY = float(os.getenv("UPSTREAM_HEDGE_DELAY", 2.0))  # 0 disables hedging
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", 0.5))
+BREAKER_LATENCY = float(os.getenv("BREAKER_LATENCY", 8.0))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", 20))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", 15.0))
+
+route_policies: Dict[str, ResiliencePolicy] = {}
+
+def route_policy(path: str) -> ResiliencePolicy:
+    policy = route_policies.get(path)
+    if policy is None:
+        policy = route_policies[path] = ResiliencePolicy(
+            path,
+            limiter=TokenBucket(UPSTREAM_RATE_LIMIT, UPSTREAM_BURST),
+            breaker=CircuitBreaker(
+                error_rate=BREAKER_ERROR_RATE,
+                latency=BREAKER_LATENCY,
+                min_calls=BREAKER_MIN_CALLS,
+                cooldown=BREAKER_COOLDOWN,
+            ),
+            budget=RetryBudget(ratio=UPSTREAM_RETRY_BUDGET),
+            max_attempts=UPSTREAM_MAX_ATTEMPTS,
+            hedge_delay=UPSTREAM_HEDGE_DELAY,
+            retry_on=(httpx.TransportError,),
+            is_failure=lambda response: response.status_code >= 500 or response.status_code == 429,
+        )
+    return policy
+
 # Cache
-stream_cache: Dict[str, Dict[str, Any]] = {}
-CACHE_DURATION = 3600
+# CACHE_BACKEND: "memory" (per-process), "sqlite:///cache.db" (shared by the
+# workers on one host) or "redis://host:6379/0" (shared by every replica)
+cache_backend = create_backend(os.getenv("CACHE_BACKEND", "memory"))
+CACHE_DURATION = 3600  # upper bound for a cached stream URL
+CACHE_SWEEP_INTERVAL = float(os.getenv("CACHE_SWEEP_INTERVAL", 60.0))
+STREAM_URL_EXPIRY_MARGIN = float(os.getenv("STREAM_URL_EXPIRY_MARGIN", 60.0))
+
+METADATA_TIMEOUT = float(os.getenv("METADATA_TIMEOUT", 3.0))
+
+stream_cache = SharedCache(TTLCache(
+    "stream",
+    max_entries=int(os.getenv("STREAM_CACHE_MAX_ENTRIES", 5000)),
+    max_bytes=int(os.getenv("STREAM_CACHE_MAX_BYTES", 0)),
+    default_ttl=CACHE_DURATION,
+), cache_backend)
+
+# Multi-region stream resolution: requests that don't name a country try
+# each of STREAM_COUNTRIES in order, either all at once ("parallel") or
+# starting the next one after STREAM_REGION_HEDGE_DELAY or a failure
+# ("hedged"). The first playable URL wins and its country is remembered per
+# track. Unset or a single country resolves in DEFAULT_COUNTRY only.
+STREAM_COUNTRIES = [c.strip().upper() for c in os.getenv("STREAM_COUNTRIES", "").split(",") if c.strip()]
+STREAM_REGION_MODE = os.getenv("STREAM_REGION_MODE", "hedged").lower()  # hedged or parallel
+STREAM_REGION_HEDGE_DELAY = float(os.getenv("STREAM_REGION_HEDGE_DELAY", 0.3))
+region_index = SharedCache(TTLCache(
+    "regions",
+    max_entries=int(os.getenv("REGION_INDEX_MAX_ENTRIES", 50000)),
+    default_ttl=float(os.getenv("REGION_INDEX_TTL", 7 * 86400)),
+), cache_backend)
+region_stats = {"lookups": 0, "known": 0, "fallbacks": 0, "unavailable": 0}
+
+# Search results, keyed by country and normalized query
+SEARCH_CACHE_DEPTH = 25  # enough for /search (20) and /related (limit + 5)
+SEARCH_NEGATIVE_TTL = float(os.getenv("SEARCH_NEGATIVE_TTL", 60))
+search_cache = SharedCache(TTLCache(
+    "search",
+    max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", 2000)),
+    max_bytes=int(os.getenv("SEARCH_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    default_ttl=float(os.getenv("SEARCH_CACHE_TTL", 600)),
+    stale_ttl=float(os.getenv("SEARCH_STALE_TTL", 3600)),
+), cache_backend, decode=lambda tracks: [Track.from_dict(t) for t in tracks])
+
+# Local autocomplete built from every track seen in search results
+AUTOCOMPLETE_PLAY_WEIGHT = 5.0
+autocomplete = AutocompleteIndex(max_terms=int(os.getenv("AUTOCOMPLETE_MAX_TERMS", 50000)))
+
+# Radio recommendations from tracks seen together in searches, charts and plays
+recommender = Recommender(
+    max_tracks=int(os.getenv("RECOMMEND_MAX_TRACKS", 50000)),
+    artist_cap=int(os.getenv("RECOMMEND_ARTIST_CAP", 3)),
+)
+
+# Same-origin audio proxy (/audio)
+AUDIO_CHUNK_SIZE = int(os.getenv("AUDIO_CHUNK_SIZE", 64 * 1024))
+AUDIO_MAX_CONNECTIONS = int(os.getenv("AUDIO_MAX_CONNECTIONS", 200))
+AUDIO_READ_TIMEOUT = float(os.getenv("AUDIO_READ_TIMEOUT", 30.0))
+AUDIO_PASSTHROUGH_HEADERS = (
+    "content-type", "content-length", "content-range", "accept-ranges",
+    "etag", "last-modified",
+)
+
+# Local segment cache for hot audio (disabled unless AUDIO_CACHE_DIR is set)
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "")
+segment_cache = SegmentCache(
+    AUDIO_CACHE_DIR,
+    segment_size=int(os.getenv("AUDIO_SEGMENT_SIZE", 1024 * 1024)),
+    max_bytes=int(os.getenv("AUDIO_CACHE_MAX_BYTES", 2 * 1024 ** 3)),
+    admit_after=int(os.getenv("AUDIO_CACHE_ADMIT_AFTER", 2)),
+) if AUDIO_CACHE_DIR else None
+segment_flight = SingleFlight()
+
+# Batch resolution (/stream/batch, /tracks/batch)
+BATCH_MAX_IDS = int(os.getenv("BATCH_MAX_IDS", 50))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+
+# Opt-in warming of the stream cache for upcoming radio tracks
+PREFETCH_MAX_TRACKS = int(os.getenv("PREFETCH_MAX_TRACKS", 5))
+prefetcher = Prefetcher(
+    max_concurrency=int(os.getenv("PREFETCH_CONCURRENCY", 4)),
+    user_budget=int(os.getenv("PREFETCH_USER_BUDGET", 30)),
+    budget_window=float(os.getenv("PREFETCH_BUDGET_WINDOW", 60)),
+)
+
+# Charts change slowly; stale charts are served while a refresh runs
+CHARTS_REFRESH_INTERVAL = float(os.getenv("CHARTS_REFRESH_INTERVAL", 3600))
+CHART_COUNTRIES = [c.strip().upper() for c in os.getenv("CHART_COUNTRIES", DEFAULT_COUNTRY).split(",") if c.strip()]
+chart_cache = SharedCache(TTLCache(
+    "charts",
+    max_entries=32,
+    default_ttl=float(os.getenv("CHARTS_MAX_AGE", 86400)),
+), cache_backend, decode=lambda chart: {**chart, "tracks": [Track.from_dict(t) for t in chart["tracks"]]})
+charts_flight = SingleFlight()
+
+# Assembled artist pages (info, top tracks, albums); like charts, a page
+# older than ARTIST_REFRESH_INTERVAL is served while a refresh replaces it
+ARTIST_REFRESH_INTERVAL = float(os.getenv("ARTIST_REFRESH_INTERVAL", 3600))
+ARTIST_RETRY_INTERVAL = float(os.getenv("ARTIST_RETRY_INTERVAL", 60))  # for pages missing tracks or albums
+ARTIST_PAGE_SIZE = int(os.getenv("ARTIST_PAGE_SIZE", 10))  # first paint; the rest is paged
+ARTIST_MAX_ALBUMS = 50
+artist_cache = SharedCache(TTLCache(
+    "artists",
+    max_entries=int(os.getenv("ARTIST_CACHE_MAX_ENTRIES", 2000)),
+    default_ttl=float(os.getenv("ARTIST_CACHE_TTL", 86400)),
+), cache_backend, decode=lambda page: {**page, "tracks": [Track.from_dict(t) for t in page["tracks"]]})
+artist_flight = SingleFlight()
+
+# Track metadata outlives the signed URL it was fetched with
+metadata_cache = SharedCache(TTLCache(
+    "metadata",
+    max_entries=int(os.getenv("METADATA_CACHE_MAX_ENTRIES", 20000)),
+    default_ttl=float(os.getenv("METADATA_CACHE_TTL", 86400)),
+    stale_ttl=float(os.getenv("METADATA_STALE_TTL", 86400)),
+), cache_backend)
+
+# Play history, batched into Supabase; disabled unless the service key and
+# JWT secret (to verify the caller's session) are configured
+SUPABASE_URL = os.getenv("SUPABASE_URL", "")
+SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY", "")
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "")
+HISTORY_MAX_EVENTS = int(os.getenv("HISTORY_MAX_EVENTS", 50))  # per request
+history_writer = HistoryWriter(
+    SUPABASE_URL,
+    SUPABASE_SERVICE_KEY,
+    os.getenv("HISTORY_WAL_DIR", "history-wal"),
+    max_batch=int(os.getenv("HISTORY_BATCH_SIZE", 500)),
+    flush_interval=float(os.getenv("HISTORY_FLUSH_INTERVAL", 2.0)),
+) if SUPABASE_URL and SUPABASE_SERVICE_KEY and SUPABASE_JWT_SECRET else None
+
+# Warm restarts: the local caches are saved to CACHE_SNAPSHOT_PATH every
+# CACHE_SNAPSHOT_INTERVAL seconds and at shutdown, and reloaded at startup.
+# Workers sharing a path each write the whole file; the last write wins.
+CACHE_SNAPSHOT_PATH = os.getenv("CACHE_SNAPSHOT_PATH", "")
+CACHE_SNAPSHOT_INTERVAL = float(os.getenv("CACHE_SNAPSHOT_INTERVAL", 300))
+cache_snapshot = CacheSnapshot(CACHE_SNAPSHOT_PATH, {
+    "stream": stream_cache, "metadata": metadata_cache,
+    "search": search_cache, "charts": chart_cache, "regions": region_index,
+    "artists": artist_cache,
+}) if CACHE_SNAPSHOT_PATH else None
+
+# Stream URLs resolved before /info reports ready: the WARMUP_TOP_N most
+# popular tracks, from WARMUP_FILE (one id per line) or else the snapshot
+WARMUP_FILE = os.getenv("WARMUP_FILE", "")
+WARMUP_TOP_N = int(os.getenv("WARMUP_TOP_N", 0))
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", 30.0))
+warmup_stats = {"ready": False, "warmed": 0, "failed": 0, "seconds": None}
+cache_restored = asyncio.Event()
 
 def get_headers() -> dict:
     """Get standard headers for API requests"""
@@ -42,219 +271,630 @@ def get_headers() -> dict:
         headers["Authorization"] = f"Bearer {AMAZON_AUTH_TOKEN}"
     return headers
 
-def transform_track(amz_track: dict) -> dict:
-    """Transform Amazon Music track to frontend-compatible format"""
-    try:
-        # Extract artists
-        artists = []
-        if isinstance(amz_track.get("artists"), list):
-            for artist in amz_track.get("artists", []):
-                if isinstance(artist, dict):
-                    artists.append({
-                        "name": str(artist.get("name", "Unknown")),
-                        "id": str(artist.get("id", "") or artist.get("asin", ""))
-                    })
-                elif isinstance(artist, str):
-                    artists.append({"name": artist, "id": ""})
-        elif isinstance(amz_track.get("artist"), dict):
-            artist_obj = amz_track.get("artist")
-            artists.append({
-                "name": str(artist_obj.get("name", "Unknown")),
-                "id": str(artist_obj.get("id", "") or artist_obj.get("asin", ""))
-            })
-        elif isinstance(amz_track.get("artist"), str):
-            artists.append({"name": amz_track.get("artist"), "id": ""})
-        
-        if not artists:
-            artists = [{"name": "Unknown Artist", "id": ""}]
-
-        # Extract album
-        album_data = amz_track.get("album", {})
-        if isinstance(album_data, dict):
-            album = {
-                "name": str(album_data.get("title", "") or album_data.get("name", "") or "Unknown Album"),
-                "id": str(album_data.get("id", "") or album_data.get("asin", "") or "")
-            }
-        elif isinstance(album_data, str):
-            album = {"name": album_data, "id": ""}
-        else:
-            album = {"name": "Unknown Album", "id": ""}
-
-        # Extract thumbnails
-        thumbnails = []
-        cover_url = (
-            amz_track.get("cover") or 
-            amz_track.get("image") or 
-            amz_track.get("artwork") or
-            amz_track.get("thumbnail")
-        )
-        if cover_url:
-            thumbnails = [{"url": str(cover_url), "width": 500, "height": 500}]
-
-        track_id = (
-            amz_track.get("id") or 
-            amz_track.get("trackId") or 
-            amz_track.get("asin") or 
-            ""
-        )
+def create_http_client() -> httpx.AsyncClient:
+    """Build the pooled upstream client used for the lifetime of the app"""
+    http2 = UPSTREAM_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            log.warning("UPSTREAM_HTTP2 is set but 'h2' is not installed, falling back to HTTP/1.1")
+            http2 = False
 
-        title = (
-            amz_track.get("title") or 
-            amz_track.get("name") or 
-            "Unknown Title"
-        )
+    return httpx.AsyncClient(
+        base_url=AMAZON_MUSIC_API,
+        headers=get_headers(),
+        http2=http2,
+        follow_redirects=True,
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(20.0, pool=UPSTREAM_POOL_TIMEOUT),
+    )
+
+def create_audio_client() -> httpx.AsyncClient:
+    """Pooled client for proxying audio from signed stream URLs"""
+    return httpx.AsyncClient(
+        headers={"User-Agent": get_headers()["User-Agent"], "Accept-Encoding": "identity"},
+        follow_redirects=True,
+        limits=httpx.Limits(
+            max_connections=AUDIO_MAX_CONNECTIONS,
+            max_keepalive_connections=AUDIO_MAX_CONNECTIONS,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(AUDIO_READ_TIMEOUT, connect=10.0, pool=UPSTREAM_POOL_TIMEOUT),
+    )
 
-        duration = amz_track.get("duration") or amz_track.get("durationSeconds")
-        if duration:
+# Fire-and-forget tasks, referenced here so they aren't garbage collected
+pending_tasks = set()
+
+def spawn(coro) -> "asyncio.Task":
+    task = asyncio.create_task(coro)
+    pending_tasks.add(task)
+    task.add_done_callback(pending_tasks.discard)
+    return task
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client, audio_client
+    http_client = create_http_client()
+    audio_client = create_audio_client()
+    background_tasks = [
+        asyncio.create_task(stream_cache.run_sweeper(CACHE_SWEEP_INTERVAL)),
+        asyncio.create_task(metadata_cache.run_sweeper(CACHE_SWEEP_INTERVAL)),
+        asyncio.create_task(search_cache.run_sweeper(CACHE_SWEEP_INTERVAL)),
+        asyncio.create_task(chart_cache.run_sweeper(CACHE_SWEEP_INTERVAL)),
+        asyncio.create_task(region_index.run_sweeper(CACHE_SWEEP_INTERVAL)),
+        asyncio.create_task(artist_cache.run_sweeper(CACHE_SWEEP_INTERVAL)),
+        asyncio.create_task(charts_refresher()),
+        asyncio.create_task(warm_start()),
+    ]
+    if history_writer is not None:
+        history_writer.start()
+        background_tasks.append(asyncio.create_task(history_writer.run()))
+    if cache_snapshot is not None:
+        background_tasks.append(asyncio.create_task(cache_snapshot.run(CACHE_SNAPSHOT_INTERVAL, snapshot_extra)))
+    try:
+        yield
+    finally:
+        background_tasks.extend(pending_tasks)
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        await prefetcher.close()
+        # A process stopped before its restore finished would save less than it loaded
+        if cache_snapshot is not None and cache_restored.is_set():
             try:
-                duration = int(duration)
-            except (ValueError, TypeError):
-                duration = None
-
-        return {
-            "videoId": str(track_id),
-            "title": str(title),
-            "artists": artists,
-            "album": album,
-            "duration": duration,
-            "duration_seconds": duration,
-            "thumbnails": thumbnails,
-            "isExplicit": bool(amz_track.get("explicit", False)),
-            "year": amz_track.get("year") or amz_track.get("releaseYear") or None
-        }
-    except Exception as e:
-        print(f"⚠️ Error transforming track: {e}")
-        return {
-            "videoId": str(amz_track.get("id", "") or amz_track.get("asin", "") or "unknown"),
-            "title": "Unknown",
-            "artists": [{"name": "Unknown", "id": ""}],
-            "album": {"name": "Unknown", "id": ""},
-            "duration": None,
-            "duration_seconds": None,
-            "thumbnails": [],
-            "isExplicit": False,
-            "year": None
-        }
+                await cache_snapshot.save(snapshot_extra())
+            except Exception as e:
+                log.warning("cache snapshot failed", extra={"path": CACHE_SNAPSHOT_PATH, "error": repr(e)})
+        if history_writer is not None:
+            await history_writer.close()
+        if cache_backend is not None:
+            await cache_backend.close()
+        await audio_client.aclose()
+        await http_client.aclose()
+        http_client = audio_client = None
+
+async def upstream_get(path: str, params: dict, endpoint: str) -> httpx.Response:
+    """
+    GET an upstream path through the shared client.
+
+    Concurrent requests for the same path and params share one upstream
+    call; the first caller's endpoint timeout applies to all of them.
+    """
+    key = (path, tuple(sorted(params.items())))
+    return await upstream_flight.do(key, lambda: _upstream_fetch(path, params, endpoint))
+
+async def _upstream_fetch(path: str, params: dict, endpoint: str) -> httpx.Response:
+    """Rate-limited, circuit-broken, retried and hedged upstream GET"""
+    timeout = httpx.Timeout(UPSTREAM_TIMEOUTS[endpoint], pool=UPSTREAM_POOL_TIMEOUT)
+    return await route_policy(path).call(lambda: _upstream_attempt(path, params, timeout))
+
+async def _upstream_attempt(path: str, params: dict, timeout: httpx.Timeout) -> httpx.Response:
+    upstream_stats["requests"] += 1
+    upstream_stats["in_flight"] += 1
+    upstream_stats["peak_in_flight"] = max(upstream_stats["peak_in_flight"], upstream_stats["in_flight"])
+    status = "error"
+    started = time.perf_counter()
+    try:
+        response = await http_client.get(path, params=params, timeout=timeout)
+        status = str(response.status_code)
+        return response
+    except httpx.PoolTimeout:
+        status = "pool_timeout"
+        upstream_stats["pool_timeouts"] += 1
+        upstream_stats["errors"] += 1
+        raise
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    except Exception:
+        upstream_stats["errors"] += 1
+        raise
+    finally:
+        upstream_stats["in_flight"] -= 1
+        upstream_requests.inc(path, status)
+        upstream_latency.observe(time.perf_counter() - started, path)
+
+def upstream_unavailable(e: UpstreamUnavailable) -> HTTPException:
+    """503 for a request shed by the resilience layer, with a retry hint"""
+    log.warning("upstream unavailable", extra={"route": e.route, "reason": e.reason})
+    return HTTPException(
+        status_code=503,
+        detail="Music service is temporarily unavailable, please retry shortly.",
+        headers={"Retry-After": str(int(BREAKER_COOLDOWN))}
+    )
+
+def upstream_pool_stats() -> dict:
+    """Snapshot of upstream connection-pool saturation"""
+    stats = dict(upstream_stats)
+    stats["max_connections"] = UPSTREAM_MAX_CONNECTIONS
+    stats["max_keepalive_connections"] = UPSTREAM_MAX_KEEPALIVE
+    stats["saturation"] = round(upstream_stats["in_flight"] / UPSTREAM_MAX_CONNECTIONS, 3)
+
+    # httpx does not expose the pool publicly; read httpcore's view if present
+    pool = getattr(getattr(http_client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is not None:
+        stats["open_connections"] = len(connections)
+        stats["idle_connections"] = sum(1 for c in connections if c.is_idle())
+    return stats
+
+def register_collected_metrics():
+    """Export the counters the subsystems already keep, read at scrape time"""
+    caches = {
+        "stream": stream_cache, "metadata": metadata_cache,
+        "search": search_cache, "charts": chart_cache, "regions": region_index,
+        "artists": artist_cache,
+    }
+
+    def per_cache(field):
+        return lambda: [((name,), cache.stats()[field]) for name, cache in caches.items()]
+
+    metrics.collected("cache_hits_total", "Cache hits (local or shared)", "counter", ("cache",), per_cache("hits"))
+    metrics.collected("cache_misses_total", "Cache misses", "counter", ("cache",), per_cache("misses"))
+    metrics.collected("cache_hit_ratio", "Lifetime cache hit ratio", "gauge", ("cache",), per_cache("hit_ratio"))
+    metrics.collected("cache_entries", "Entries held in the local cache", "gauge", ("cache",), per_cache("entries"))
+    metrics.collected("cache_bytes", "Estimated size of the local cache", "gauge", ("cache",), per_cache("bytes"))
+    metrics.collected("cache_evictions_total", "Entries evicted for space", "counter", ("cache",), per_cache("evictions"))
+
+    metrics.collected("upstream_in_flight", "Upstream requests in flight", "gauge", (),
+                      lambda: [((), upstream_stats["in_flight"])])
+    metrics.collected("upstream_singleflight_collapsed_total", "Upstream calls shared with a concurrent caller",
+                      "counter", (), lambda: [((), upstream_flight.collapsed)])
+    metrics.collected("upstream_breaker_open", "1 while a route's circuit breaker is open or half-open",
+                      "gauge", ("path",),
+                      lambda: [((path,), int(p.breaker.state != p.breaker.CLOSED)) for path, p in route_policies.items()])
+    metrics.collected("upstream_throttled_total", "Upstream calls refused by the rate limiter", "counter", ("path",),
+                      lambda: [((path,), p.limiter.throttled) for path, p in route_policies.items()])
+
+    metrics.collected("search_superseded_total", "Searches cancelled by a newer query from the same session",
+                      "counter", (), lambda: [((), search_session_stats["superseded"])])
+    metrics.collected("autocomplete_hit_ratio", "Suggestions answered from the local index", "gauge", (),
+                      lambda: [((), autocomplete.stats()["hit_ratio"])])
+    metrics.collected("recommend_hit_ratio", "/related answered from the graph alone", "gauge", (),
+                      lambda: [((), recommender.stats()["hit_ratio"])])
+    metrics.collected("prefetch_hits_total", "Stream cache hits on prefetched tracks", "counter", (),
+                      lambda: [((), prefetcher.hits)])
+    if history_writer is not None:
+        metrics.collected("history_buffered", "Play events waiting to be written to Supabase", "gauge", (),
+                          lambda: [((), history_writer.stats()["buffered"])])
+        metrics.collected("history_inserted_total", "Play events written to Supabase", "counter", (),
+                          lambda: [((), history_writer.inserted)])
+    if segment_cache is not None:
+        metrics.collected("audio_cache_hit_ratio", "Audio segments served from disk", "gauge", (),
+                          lambda: [((), segment_cache.stats()["hit_ratio"])])
+        metrics.collected("audio_cache_bytes", "Audio held in the segment cache", "gauge", (),
+                          lambda: [((), segment_cache.stats()["bytes"])])
+
+register_collected_metrics()
+
+class JSONResponse(Response):
+    """JSON body encoded by orjson, which serializes Track dataclasses natively"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+
+# Handlers on hot paths return JSONResponse directly, which skips FastAPI's
+# jsonable_encoder pass
+app = FastAPI(title="Music Streamer Backend", lifespan=lifespan, default_response_class=JSONResponse)
+
+# CORS Configuration
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=[
+        "https://lolaaaaa.netlify.app",
+        "http://localhost:3000",
+        "http://localhost:5173",
+        "*"
+    ],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+# Outermost, so CORS preflights and errors are counted too
+app.add_middleware(MetricsMiddleware, requests=http_requests, latency=http_latency, in_flight=http_in_flight)
 
 @app.get("/")
 @app.get("/info")
 def info():
-    """Health check endpoint"""
-    return {
-        "status": "ok", 
+    """Health check endpoint; 503 until the startup warm-up has finished"""
+    ready = warmup_stats["ready"]
+    return JSONResponse({
+        "status": "ok" if ready else "warming",
+        "ready": ready,
         "service": "Music Streamer Backend",
         "version": "1.1.0",
         "amazon_api": AMAZON_MUSIC_API,
         "country": DEFAULT_COUNTRY,
         "timestamp": int(time.time())
+    }, status_code=200 if ready else 503)
+
+@app.get("/stats")
+def get_stats():
+    """Runtime statistics for sizing pools and caches"""
+    return {
+        "upstream": upstream_pool_stats(),
+        "singleflight": upstream_flight.stats(),
+        "search_sessions": {"active": len(search_sessions), **search_session_stats},
+        "regions": {"countries": stream_countries(), "mode": STREAM_REGION_MODE, **region_stats},
+        "routes": {path: policy.stats() for path, policy in route_policies.items()},
+        "autocomplete": autocomplete.stats(),
+        "recommend": recommender.stats(),
+        "prefetch": prefetcher.stats(),
+        "audio_cache": segment_cache.stats() if segment_cache else None,
+        "history": history_writer.stats() if history_writer else None,
+        "warmup": warmup_stats,
+        "snapshot": cache_snapshot.stats() if cache_snapshot else None,
+        "caches": {
+            "stream": stream_cache.stats(),
+            "metadata": metadata_cache.stats(),
+            "search": search_cache.stats(),
+            "charts": chart_cache.stats(),
+            "regions": region_index.stats(),
+            "artists": artist_cache.stats(),
+        },
     }
 
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics"""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def normalize_query(q: str) -> str:
+    """Case-fold and collapse whitespace so equivalent queries share a cache entry"""
+    return " ".join(q.casefold().split())
+
+def index_tracks(tracks: List[Track], weight: float = 1.0):
+    """Feed titles, artists and albums into the autocomplete index"""
+    for t in tracks:
+        title = t.title
+        if title and title != "Unknown Title":
+            autocomplete.add(normalize_query(title), title, "track", weight, track=t)
+        for artist in t.artists:
+            name = artist["name"]
+            if name and name != "Unknown Artist":
+                autocomplete.add(normalize_query(name), name, "artist", weight)
+        album = t.album["name"]
+        if album and album != "Unknown Album":
+            autocomplete.add(normalize_query(album), album, "album", weight)
+
+def extract_tracks(data: Any) -> list:
+    if not isinstance(data, dict):
+        return []
+    return (
+        data.get("tracks") or
+        data.get("results") or
+        data.get("data") or
+        data.get("items") or
+        []
+    )
+
+def search_cache_key(query: str, country: Optional[str]) -> str:
+    return f"{(country or DEFAULT_COUNTRY).upper()}:{query}"
+
+async def fetch_search(query: str, cache_key: str, country: Optional[str], endpoint: str) -> tuple:
+    """
+    Raw upstream tracks for a normalized query as (raw, None), or
+    (None, stale) when upstream failed but an expired result is on hand.
+    """
+    params = {"query": query, "type": "track"}
+    if country:
+        params["country"] = country.upper()
+
+    try:
+        response = await upstream_get("/search", params, endpoint)
+        if response.status_code != 200:
+            raise HTTPException(status_code=502, detail=f"Amazon Music API error: {response.status_code}")
+    except (UpstreamUnavailable, httpx.HTTPError, HTTPException) as e:
+        stale = search_cache.get_stale(cache_key)
+        if stale is None:
+            raise
+        log.info("serving stale search results", extra={"query": query, "error": repr(e)})
+        return None, stale
+
+    return extract_tracks(response.json()), None
+
+async def store_search(cache_key: str, transformed: List[Track]):
+    """Cache fresh results and feed them to autocomplete and recommendations"""
+    await search_cache.set(cache_key, transformed, ttl=None if transformed else SEARCH_NEGATIVE_TTL)
+    index_tracks(transformed)
+    recommender.observe_list(transformed)
+
+async def search_tracks(q: str, country: Optional[str], endpoint: str) -> List[Track]:
+    """
+    Transformed track results for a query, shared by /search, /suggestions,
+    /related and /charts.
+
+    Results are cached per (country, normalized query); empty results are
+    cached for SEARCH_NEGATIVE_TTL. Upstream errors raise and are not cached.
+    The country is only forwarded upstream when the caller asked for one.
+    """
+    query = normalize_query(q)
+    cache_key = search_cache_key(query, country)
+    cached = await search_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    raw, stale = await fetch_search(query, cache_key, country, endpoint)
+    if stale is not None:
+        return stale
+
+    transformed = transform_tracks(raw, SEARCH_CACHE_DEPTH)
+    await store_search(cache_key, transformed)
+    return transformed
+
+# The latest search task per client session; a newer query cancels the
+# one it replaces so abandoned keystrokes stop holding upstream connections
+search_sessions: Dict[str, asyncio.Task] = {}
+search_session_stats = {"superseded": 0}
+
+def supersede_search(session: str, task: asyncio.Task):
+    previous = search_sessions.get(session)
+    if previous is not None and not previous.done():
+        previous.cancel()
+        search_session_stats["superseded"] += 1
+    search_sessions[session] = task
+
+    def forget(done: asyncio.Task):
+        if search_sessions.get(session) is done:
+            del search_sessions[session]
+
+    task.add_done_callback(forget)
+
+async def run_superseded(task: asyncio.Task, session: Optional[str]) -> bool:
+    """
+    Wait for a search task; False if a newer search from the same session
+    cancelled it. The task is cancelled if the caller goes away first.
+    """
+    if session:
+        supersede_search(session, task)
+    try:
+        await asyncio.wait({task})
+    finally:
+        if not task.done():
+            task.cancel()
+    return not task.cancelled()
+
+def ndjson_event(kind: str, data: Any) -> bytes:
+    """Tracks as bare objects, anything else as {"event": kind, ...}"""
+    if kind == "track":
+        return orjson.dumps(data) + b"\n"
+    return orjson.dumps({"event": kind, **data}) + b"\n"
+
+def sse_event(kind: str, data: Any) -> bytes:
+    return b"event: " + kind.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+async def stream_search(q: str, country: Optional[str], session: Optional[str], encode) -> AsyncIterator[bytes]:
+    """
+    /search results as events: one "track" per result as soon as it is
+    transformed, then "done", or "cancelled" / "error" instead.
+    """
+    query = normalize_query(q)
+    cache_key = search_cache_key(query, country)
+    cached = await search_cache.get(cache_key)
+    if cached is None:
+        task = asyncio.ensure_future(fetch_search(query, cache_key, country, "search"))
+        if not await run_superseded(task, session):
+            yield encode("cancelled", {"query": q})
+            return
+        try:
+            raw, cached = task.result()
+        except HTTPException as e:
+            yield encode("error", {"status": e.status_code, "detail": e.detail})
+            return
+        except Exception as e:
+            log.error("search failed", extra={"query": q, "error": repr(e)})
+            yield encode("error", {"status": 502, "detail": "Search failed"})
+            return
+
+    if cached is not None:
+        for track in cached[:20]:
+            yield encode("track", track)
+        yield encode("done", {"count": len(cached[:20])})
+        return
+
+    transformed = []
+    for item in raw[:SEARCH_CACHE_DEPTH]:
+        track = transform_track(item)
+        if track is None:
+            continue
+        transformed.append(track)
+        if len(transformed) <= 20:
+            yield encode("track", track)
+    await store_search(cache_key, transformed)
+    yield encode("done", {"count": min(len(transformed), 20)})
+
 @app.get("/search")
-async def search(q: str):
-    """Search for tracks"""
+async def search(request: Request, q: str, country: Optional[str] = None, session: Optional[str] = None):
+    """
+    Search for tracks.
+
+    With `Accept: application/x-ndjson` (one track per line, then an
+    {"event": "done"} line) or `Accept: text/event-stream`, results are
+    streamed as they are transformed. With a `session`, a newer search
+    from the same session cancels this one's upstream call; a cancelled
+    JSON search answers 409 and a streamed one ends with a "cancelled" event.
+    """
+    accept = request.headers.get("accept", "")
+    if "text/event-stream" in accept:
+        encode, media_type = sse_event, "text/event-stream"
+    elif "application/x-ndjson" in accept:
+        encode, media_type = ndjson_event, "application/x-ndjson"
+    else:
+        encode = None
+
     if not q or len(q.strip()) == 0:
+        if encode is not None:
+            return Response(encode("done", {"count": 0}), media_type=media_type)
         return []
+
+    if encode is not None:
+        return StreamingResponse(
+            stream_search(q, country, session, encode),
+            media_type=media_type,
+            headers={"cache-control": "no-cache", "x-accel-buffering": "no"}
+        )
     
     try:
-        print(f"🔍 Search request: '{q}'")
-        
-        async with httpx.AsyncClient(timeout=20.0, follow_redirects=True) as client:
-            response = await client.get(
-                f"{AMAZON_MUSIC_API}/search",
-                params={"query": q, "type": "track"},
-                headers=get_headers()
-            )
-            
-            print(f"📡 Search API response: {response.status_code}")
-            
-            if response.status_code != 200:
-                print(f"❌ API Error: {response.status_code}")
-                return []
-            
-            data = response.json()
-            tracks = (
-                data.get("tracks") or 
-                data.get("results") or 
-                data.get("data") or 
-                data.get("items") or
-                []
-            )
-            
-            if not tracks:
-                print("⚠️ No tracks found")
-                return []
-            
-            print(f"✅ Found {len(tracks)} tracks")
-            
-            transformed = []
-            for track in tracks[:20]:
-                try:
-                    t = transform_track(track)
-                    if t.get("videoId") and t.get("videoId") != "unknown":
-                        transformed.append(t)
-                except Exception as e:
-                    print(f"⚠️ Skipping track: {e}")
-                    continue
-            
-            print(f"✅ Returning {len(transformed)} valid tracks")
-            return transformed
+        task = asyncio.ensure_future(search_tracks(q, country, "search"))
+        if not await run_superseded(task, session):
+            return JSONResponse({"detail": "Superseded by a newer search in this session"}, status_code=409)
+        tracks = task.result()
+        if not tracks:
+            return []
+
+        return JSONResponse(tracks[:20])
             
     except Exception as e:
-        print(f"❌ Error in search: {e}")
+        log.error("search failed", extra={"query": q, "error": repr(e)})
         return []
 
+def chart_queries(country: str) -> List[str]:
+    """Chart search queries for a country (CHART_QUERIES_<COUNTRY>, else CHART_QUERIES)"""
+    raw = os.getenv(f"CHART_QUERIES_{country}") or os.getenv("CHART_QUERIES")
+    if raw:
+        return [q.strip() for q in raw.split(",") if q.strip()]
+    return ["Top 100", "Trending", "Popular 2024"]
+
+async def fetch_chart_query(query: str, country: str) -> List[Track]:
+    try:
+        tracks = await search_tracks(query, country, "charts")
+        return tracks[:10]
+    except Exception as e:
+        log.warning("chart query failed", extra={"query": query, "country": country, "error": repr(e)})
+        return []
+
+async def compute_charts(country: str) -> List[Track]:
+    """Run every chart query concurrently and merge them in query order"""
+    results = await asyncio.gather(*(fetch_chart_query(q, country) for q in chart_queries(country)))
+
+    seen = set()
+    unique_tracks = []
+    for tracks in results:
+        for track in tracks:
+            vid_id = track.videoId
+            if vid_id not in seen:
+                seen.add(vid_id)
+                unique_tracks.append(track)
+
+    return unique_tracks[:20]
+
+async def refresh_charts(country: str) -> List[Track]:
+    """Recompute a country's chart, keeping the previous one if upstream fails"""
+    async def compute():
+        log.info("refreshing charts", extra={"country": country})
+        tracks = await compute_charts(country)
+        if tracks:
+            await chart_cache.set(country, {"tracks": tracks, "updated": time.time()})
+        else:
+            log.warning("chart refresh returned nothing, keeping previous chart", extra={"country": country})
+        return tracks
+
+    return await charts_flight.do(country, compute)
+
+async def charts_refresher():
+    """Keep the configured countries' charts warm"""
+    # Charts restored from the snapshot don't need recomputing
+    await cache_restored.wait()
+    while True:
+        for country in CHART_COUNTRIES:
+            # Another worker sharing the cache backend may have just done it
+            cached = await chart_cache.get(country)
+            if cached is None or time.time() - cached["updated"] > CHARTS_REFRESH_INTERVAL:
+                await refresh_charts(country)
+        await asyncio.sleep(CHARTS_REFRESH_INTERVAL)
+
+def snapshot_extra() -> dict:
+    """Saved alongside the caches: what to warm up first next time"""
+    return {"popular": recommender.popular(max(WARMUP_TOP_N, 200))}
+
+def restore_search(key: str, tracks: List[Track]):
+    index_tracks(tracks)
+    recommender.observe_list(tracks)
+
+def warmup_ids(popular: List[str]) -> List[str]:
+    if WARMUP_FILE:
+        try:
+            with open(WARMUP_FILE) as f:
+                popular = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        except OSError as e:
+            log.warning("cannot read warm-up list", extra={"path": WARMUP_FILE, "error": repr(e)})
+    return popular[:WARMUP_TOP_N]
+
+async def warm_stream(video_id: str, semaphore: asyncio.Semaphore):
+    async with semaphore:
+        try:
+            await resolve_stream(video_id)
+            warmup_stats["warmed"] += 1
+        except HTTPException:
+            warmup_stats["failed"] += 1
+
+async def warm_start():
+    """
+    Restore the cache snapshot, then resolve the most popular tracks'
+    stream URLs, before /info reports ready. Requests are served meanwhile.
+    """
+    started = time.monotonic()
+    popular = []
+    try:
+        if cache_snapshot is not None:
+            extra = await cache_snapshot.load({"search": restore_search})
+            popular = extra.get("popular", [])
+        cache_restored.set()
+
+        ids = [
+            video_id for video_id in warmup_ids(popular)
+            if stream_cache_key(video_id) not in stream_cache.local
+        ]
+        if ids:
+            semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(warm_stream(video_id, semaphore) for video_id in ids)),
+                    WARMUP_TIMEOUT,
+                )
+            except asyncio.TimeoutError:
+                log.warning("warm-up timed out", extra={"warmed": warmup_stats["warmed"], "ids": len(ids)})
+    except Exception:
+        log.exception("warm start failed")
+    finally:
+        # Never keep a replica out of rotation because warming failed
+        cache_restored.set()
+        warmup_stats["ready"] = True
+        warmup_stats["seconds"] = round(time.monotonic() - started, 2)
+        log.info("ready", extra={k: v for k, v in warmup_stats.items() if k != "ready"})
+
 @app.get("/charts")
-async def get_charts():
-    """Get charts"""
+async def get_charts(country: Optional[str] = None):
+    """
+    Get charts.
+
+    Served from memory; a chart older than CHARTS_REFRESH_INTERVAL is
+    returned as-is while a background refresh replaces it.
+    """
+    country = (country or DEFAULT_COUNTRY).upper()
     try:
-        print("📊 Fetching charts...")
-        
-        async with httpx.AsyncClient(timeout=20.0) as client:
-            queries = ["Top 100", "Trending", "Popular 2024"]
-            all_tracks = []
-            
-            for query in queries:
-                try:
-                    response = await client.get(
-                        f"{AMAZON_MUSIC_API}/search",
-                        params={"query": query, "type": "track"},
-                        headers=get_headers()
-                    )
-                    
-                    if response.status_code == 200:
-                        data = response.json()
-                        tracks = data.get("tracks") or data.get("results") or data.get("data") or []
-                        for track in tracks[:10]:
-                            try:
-                                t = transform_track(track)
-                                if t.get("videoId") and t.get("videoId") != "unknown":
-                                    all_tracks.append(t)
-                            except:
-                                continue
-                    
-                    if len(all_tracks) >= 20:
-                        break
-                except:
-                    continue
-            
-            seen = set()
-            unique_tracks = []
-            for track in all_tracks:
-                vid_id = track.get("videoId")
-                if vid_id and vid_id not in seen:
-                    seen.add(vid_id)
-                    unique_tracks.append(track)
-            
-            result = unique_tracks[:20]
-            print(f"✅ Returning {len(result)} chart tracks")
-            return result
-            
+        cached = await chart_cache.get(country)
+        if cached is None:
+            return JSONResponse(await refresh_charts(country))
+
+        if time.time() - cached["updated"] > CHARTS_REFRESH_INTERVAL:
+            spawn(refresh_charts(country))
+        return JSONResponse(cached["tracks"])
+
     except Exception as e:
-        print(f"❌ Error in charts: {e}")
+        log.error("charts failed", extra={"country": country, "error": repr(e)})
         return []
 
 @app.get("/suggestions")
-async def get_suggestions(q: str = ""):
+async def get_suggestions(q: str = "", country: Optional[str] = None):
     """Get suggestions"""
     try:
         if not q or len(q.strip()) == 0:
@@ -270,287 +910,848 @@ async def get_suggestions(q: str = ""):
                 ]
             }
         
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            response = await client.get(
-                f"{AMAZON_MUSIC_API}/search",
-                params={"query": q, "type": "track"},
-                headers=get_headers()
-            )
-            
-            if response.status_code != 200:
-                return {"queries": [], "results": []}
-            
-            data = response.json()
-            tracks = data.get("tracks") or data.get("results") or data.get("data") or []
-            
-            transformed_tracks = []
-            for track in tracks[:5]:
-                try:
-                    t = transform_track(track)
-                    if t.get("videoId") and t.get("videoId") != "unknown":
-                        transformed_tracks.append(t)
-                except:
-                    continue
-            
-            queries = [q, f"{q} songs", f"{q} hits"][:3]
+        # Answer from the local index when it knows the prefix
+        matches = autocomplete.suggest(normalize_query(q), limit=5)
+        results = [m.track for m in matches if m.track is not None]
+        if matches and not results:
+            # Artist and album terms carry no track: show what a search for
+            # the query, or for the best match, already has in the cache
+            for query in (q, matches[0].text):
+                cached = await search_cache.get(search_cache_key(normalize_query(query), country))
+                if cached:
+                    results = cached[:5]
+                    break
+        if results:
+            return JSONResponse({
+                "queries": [m.text for m in matches],
+                "results": results
+            })
+
+        tracks = await search_tracks(q, country, "suggestions")
+        transformed_tracks = tracks[:5]
+
+        queries = [m.text for m in matches] or [q, f"{q} songs", f"{q} hits"][:3]
             
-            return {
-                "queries": queries,
-                "results": transformed_tracks
-            }
+        return JSONResponse({
+            "queries": queries,
+            "results": transformed_tracks
+        })
             
     except Exception as e:
-        print(f"Error getting suggestions: {e}")
+        log.error("suggestions failed", extra={"query": q, "error": repr(e)})
         return {"queries": [], "results": []}
 
+async def fetch_artist_info(browse_id: str) -> dict:
+    response = await upstream_get("/artist", {"id": browse_id}, "artist")
+    if response.status_code != 200:
+        raise HTTPException(status_code=404, detail="Artist not found")
+    data = response.json()
+    return data.get("artist") or data.get("data") or data
+
+async def fetch_artist_albums(name: str) -> List[dict]:
+    """Album search for an artist; results that come back as tracks yield their album"""
+    response = await upstream_get("/search", {"query": name, "type": "album"}, "artist")
+    if response.status_code != 200:
+        raise HTTPException(status_code=502, detail=f"Amazon Music API error: {response.status_code}")
+    data = response.json()
+    raw = (data.get("albums") if isinstance(data, dict) else None) or extract_tracks(data)
+    albums = []
+    for item in raw:
+        if isinstance(item, dict) and "album" in item:
+            track = transform_track(item)
+            album = album_of(track) if track is not None else None
+        else:
+            album = transform_album(item)
+        if album is not None:
+            albums.append(album)
+    return albums
+
+def by_artist(artists: List[dict], browse_id: str, name: str) -> bool:
+    key = name.casefold()
+    return any(a["id"] == browse_id or a["name"].casefold() == key for a in artists)
+
+async def compute_artist(browse_id: str) -> dict:
+    """
+    Artist info, then their top tracks and albums fetched concurrently.
+
+    Top tracks are the search results for the artist's name that credit
+    them; albums come from an album search plus those tracks' albums. A
+    failed track or album lookup leaves that list empty and marks the page
+    for a refresh after ARTIST_RETRY_INTERVAL instead of failing it.
+    """
+    artist = await fetch_artist_info(browse_id)
+    name = str(artist.get("name", "Unknown"))
+
+    tracks, albums = await asyncio.gather(
+        search_tracks(name, None, "artist"), fetch_artist_albums(name), return_exceptions=True
+    )
+    complete = True
+    for result in (tracks, albums):
+        if isinstance(result, BaseException):
+            complete = False
+            log.warning("artist page partly unavailable", extra={"browse_id": browse_id, "error": repr(result)})
+    tracks = [] if isinstance(tracks, BaseException) else tracks
+    albums = [] if isinstance(albums, BaseException) else albums
+
+    credited = [t for t in tracks if by_artist(t.artists, browse_id, name)]
+    seen = set()
+    unique_albums = []
+    for album in albums + [album_of(t) for t in credited]:
+        if album is None or album["browseId"] in seen or not by_artist(album["artists"], browse_id, name):
+            continue
+        seen.add(album["browseId"])
+        unique_albums.append(album)
+
+    return {
+        "name": name,
+        "description": str(artist.get("bio", "") or artist.get("description", "") or ""),
+        "views": artist.get("followers"),
+        "thumbnails": [{"url": str(artist.get("image", "") or artist.get("cover", ""))}],
+        "tracks": credited or tracks,
+        "albums": unique_albums[:ARTIST_MAX_ALBUMS],
+        # An incomplete page comes due for refresh after ARTIST_RETRY_INTERVAL
+        "updated": time.time() if complete else time.time() - ARTIST_REFRESH_INTERVAL + ARTIST_RETRY_INTERVAL,
+        "complete": complete,
+    }
+
+async def refresh_artist(browse_id: str) -> dict:
+    """Rebuild an artist page, keeping the cached one if upstream fails"""
+    async def compute():
+        page = await compute_artist(browse_id)
+        if not page["complete"]:
+            # Don't trade a complete page for one missing its tracks or albums,
+            # but retry on the same schedule as an incomplete page
+            previous = await artist_cache.get(browse_id)
+            if previous is not None and previous.get("complete"):
+                log.warning("artist refresh incomplete, keeping previous page", extra={"browse_id": browse_id})
+                page = {**previous, "updated": page["updated"]}
+        await artist_cache.set(browse_id, page)
+        return page
+
+    return await artist_flight.do(browse_id, compute)
+
+async def refresh_artist_quietly(browse_id: str):
+    try:
+        await refresh_artist(browse_id)
+    except Exception as e:
+        log.warning("artist refresh failed", extra={"browse_id": browse_id, "error": repr(e)})
+
+def artist_section(items: list, cursor: Optional[str], limit: int) -> dict:
+    """One page of a list, with the cursor for the next one (None at the end)"""
+    start = int(cursor) if cursor and cursor.isdigit() else 0
+    end = start + max(1, min(limit, 50))
+    return {"results": items[start:end], "next": str(end) if end < len(items) else None}
+
 @app.get("/artist/{browse_id}")
-async def get_artist(browse_id: str):
-    """Get artist info"""
+async def get_artist(browse_id: str, section: Optional[str] = None, cursor: Optional[str] = None,
+                     limit: int = ARTIST_PAGE_SIZE):
+    """
+    Get an artist page: info plus the first page of top songs and albums.
+
+    Pass section=songs or section=albums with the previous response's
+    "next" cursor for further pages of that list.
+    """
+    if section not in (None, "songs", "albums"):
+        raise HTTPException(status_code=400, detail="section must be songs or albums")
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            response = await client.get(
-                f"{AMAZON_MUSIC_API}/artist",
-                params={"id": browse_id},
-                headers=get_headers()
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(status_code=404, detail="Artist not found")
-            
-            data = response.json()
-            artist = data.get("artist") or data.get("data") or data
-            
-            return {
-                "name": str(artist.get("name", "Unknown")),
-                "description": str(artist.get("bio", "") or artist.get("description", "") or ""),
-                "views": artist.get("followers"),
-                "thumbnails": [{"url": str(artist.get("image", "") or artist.get("cover", ""))}],
-                "songs": {"browseId": str(browse_id)}
-            }
-            
+        page = await artist_cache.get(browse_id)
+        if page is None:
+            page = await refresh_artist(browse_id)
+        elif time.time() - page["updated"] > ARTIST_REFRESH_INTERVAL:
+            spawn(refresh_artist_quietly(browse_id))
+
+        if section == "songs":
+            return JSONResponse(artist_section(page["tracks"], cursor, limit))
+        if section == "albums":
+            return JSONResponse(artist_section(page["albums"], cursor, limit))
+        return JSONResponse({
+            "name": page["name"],
+            "description": page["description"],
+            "views": page["views"],
+            "thumbnails": page["thumbnails"],
+            "songs": {"browseId": browse_id, **artist_section(page["tracks"], None, limit)},
+            "albums": artist_section(page["albums"], None, limit),
+        })
+
     except HTTPException:
         raise
+    except UpstreamUnavailable as e:
+        raise upstream_unavailable(e)
     except Exception as e:
-        print(f"Error getting artist: {e}")
+        log.error("artist lookup failed", extra={"browse_id": browse_id, "error": repr(e)})
         raise HTTPException(status_code=500, detail=str(e))
 
+def client_id(request: Request) -> str:
+    """Identify a client for per-user budgets (X-Client-Id, else its address)"""
+    return request.headers.get("x-client-id") or (request.client.host if request.client else "unknown")
+
+def prefetch_streams(request: Request, tracks: List[Track]):
+    """Warm the stream cache for tracks the client is about to play"""
+    user = client_id(request)
+    for track in tracks[:PREFETCH_MAX_TRACKS]:
+        video_id = track.videoId
+        cache_key = stream_cache_key(video_id)
+        if cache_key in stream_cache.local:
+            continue
+        prefetcher.schedule(user, cache_key, lambda video_id=video_id: resolve_stream(video_id))
+
+async def seed_artist(video_id: str) -> str:
+    """First artist of a track: from the graph, the metadata cache, else /track"""
+    artist_name = recommender.artist_of(video_id)
+    if artist_name:
+        return artist_name
+    cached = await metadata_cache.get(video_id)
+    if cached is not None and cached["artist"] != "Unknown":
+        return cached["artist"]
+
+    track_response = await upstream_get("/track", {"id": video_id}, "related")
+    if track_response.status_code != 200:
+        return ""
+    track_data = track_response.json()
+    track = track_data.get("track") or track_data.get("data") or track_data
+
+    artist_name = ""
+    if isinstance(track.get("artist"), dict):
+        artist_name = track.get("artist", {}).get("name", "")
+    elif isinstance(track.get("artist"), str):
+        artist_name = track.get("artist")
+    elif track.get("artists") and len(track.get("artists", [])) > 0:
+        first_artist = track.get("artists")[0]
+        if isinstance(first_artist, dict):
+            artist_name = first_artist.get("name", "")
+        elif isinstance(first_artist, str):
+            artist_name = first_artist
+    return artist_name
+
 @app.get("/related/{video_id}")
-async def get_related(video_id: str, limit: int = 20):
-    """Get related tracks"""
+async def get_related(video_id: str, request: Request, limit: int = 20, prefetch: int = 0):
+    """
+    Get related tracks.
+
+    Answered from the recommendation graph when it knows enough about the
+    track. Otherwise one search on the track's artist (usually a cache hit)
+    feeds the graph and tops up the results.
+
+    With `prefetch=K`, stream URLs for the first K results (capped at
+    PREFETCH_MAX_TRACKS) are resolved in the background so the next track
+    starts from cache.
+    """
+    related = recommender.related(video_id, limit)
+    if len(related) < limit:
+        # A failed top-up still leaves whatever the graph produced
+        try:
+            artist_name = await seed_artist(video_id)
+            if artist_name:
+                tracks = await search_tracks(artist_name, None, "related")
+                related = recommender.related(video_id, limit)
+                seen = {t.videoId for t in related}
+                seen.add(video_id)
+                related += [t for t in tracks if t.videoId not in seen][:limit - len(related)]
+        except Exception as e:
+            log.warning("related top-up failed", extra={
+                "video_id": video_id, "found": len(related), "error": repr(e),
+            })
+
+    if prefetch > 0:
+        prefetch_streams(request, related[:prefetch])
+    return JSONResponse(related)
+
+def stream_url_expiry(url: str) -> Optional[float]:
+    """Read the expiry timestamp embedded in a signed stream URL, if any"""
     try:
-        print(f"🎵 Fetching related for: {video_id}")
-        
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            track_response = await client.get(
-                f"{AMAZON_MUSIC_API}/track",
-                params={"id": video_id},
-                headers=get_headers()
-            )
-            
-            if track_response.status_code == 200:
-                track_data = track_response.json()
-                track = track_data.get("track") or track_data.get("data") or track_data
-                
-                artist_name = ""
-                if isinstance(track.get("artist"), dict):
-                    artist_name = track.get("artist", {}).get("name", "")
-                elif isinstance(track.get("artist"), str):
-                    artist_name = track.get("artist")
-                elif track.get("artists") and len(track.get("artists", [])) > 0:
-                    first_artist = track.get("artists")[0]
-                    if isinstance(first_artist, dict):
-                        artist_name = first_artist.get("name", "")
-                    elif isinstance(first_artist, str):
-                        artist_name = first_artist
-                
-                if artist_name:
-                    search_response = await client.get(
-                        f"{AMAZON_MUSIC_API}/search",
-                        params={"query": artist_name, "type": "track"},
-                        headers=get_headers()
-                    )
-                    
-                    if search_response.status_code == 200:
-                        data = search_response.json()
-                        tracks = data.get("tracks") or data.get("results") or data.get("data") or []
-                        related = []
-                        for t in tracks[:limit + 5]:
-                            try:
-                                transformed = transform_track(t)
-                                if (transformed.get("videoId") and 
-                                    transformed.get("videoId") != "unknown" and
-                                    transformed.get("videoId") != video_id):
-                                    related.append(transformed)
-                            except:
-                                continue
-                        return related[:limit]
-            
-            return []
-            
+        query = {k.lower(): v[0] for k, v in parse_qs(urlsplit(url).query).items()}
+    except ValueError:
+        return None
+
+    # CloudFront / generic signed URLs: absolute unix timestamp
+    for key in ("expires", "exp", "e"):
+        if query.get(key, "").isdigit():
+            return float(query[key])
+
+    # Akamai tokens: hdnts=st=...~exp=...~hmac=...
+    token = query.get("hdnts") or query.get("__token__")
+    if token:
+        for part in token.split("~"):
+            name, _, value = part.partition("=")
+            if name == "exp" and value.isdigit():
+                return float(value)
+
+    # AWS SigV4: X-Amz-Date + X-Amz-Expires (seconds)
+    if query.get("x-amz-date") and query.get("x-amz-expires", "").isdigit():
+        try:
+            signed_at = datetime.strptime(query["x-amz-date"], "%Y%m%dT%H%M%SZ")
+        except ValueError:
+            return None
+        return signed_at.replace(tzinfo=timezone.utc).timestamp() + int(query["x-amz-expires"])
+
+    return None
+
+def stream_url_ttl(url: str) -> float:
+    """How long a resolved stream URL may be served from cache"""
+    expires = stream_url_expiry(url)
+    if expires is None:
+        return CACHE_DURATION
+    return min(CACHE_DURATION, expires - time.time() - STREAM_URL_EXPIRY_MARGIN)
+
+async def fetch_track_metadata(video_id: str) -> Optional[dict]:
+    """
+    Best-effort title/artist/artwork lookup for a track.
+
+    Bounded by METADATA_TIMEOUT so a slow /track call never holds up the
+    stream URL; failures return None and are not cached.
+    """
+    cached = await metadata_cache.get(video_id)
+    if cached is not None:
+        return cached
+
+    try:
+        track_response = await asyncio.wait_for(
+            upstream_get("/track", {"id": video_id}, "stream"),
+            timeout=METADATA_TIMEOUT
+        )
+        if track_response.status_code != 200:
+            return metadata_cache.get_stale(video_id)
+        track_data = track_response.json()
+        track_info = track_data.get("track") or track_data.get("data") or track_data
     except Exception as e:
-        print(f"Error getting related tracks: {e}")
-        return []
+        log.debug("track metadata unavailable", extra={"video_id": video_id, "error": repr(e)})
+        return metadata_cache.get_stale(video_id)
 
-@app.get("/stream/{video_id}")
-async def get_stream_url(video_id: str, country: Optional[str] = None):
+    # Extract artist name
+    artist_name = "Unknown"
+    if isinstance(track_info.get("artist"), dict):
+        artist_name = track_info.get("artist", {}).get("name", "Unknown")
+    elif isinstance(track_info.get("artist"), str):
+        artist_name = track_info.get("artist")
+    elif track_info.get("artists") and len(track_info.get("artists", [])) > 0:
+        first_artist = track_info.get("artists")[0]
+        if isinstance(first_artist, dict):
+            artist_name = first_artist.get("name", "Unknown")
+        elif isinstance(first_artist, str):
+            artist_name = first_artist
+
+    metadata = {
+        "title": str(track_info.get("title", "") or track_info.get("name", "Unknown")),
+        "thumbnail": str(track_info.get("cover", "") or track_info.get("image", "") or ""),
+        "artist": str(artist_name),
+        "duration": track_info.get("duration")
+    }
+    await metadata_cache.set(video_id, metadata)
+    return metadata
+
+def extract_stream_url(stream_data: Any) -> Optional[str]:
+    """Pull the best stream URL out of a /stream_urls response"""
+    stream_url = None
+
+    if isinstance(stream_data, str):
+        # Direct URL string
+        stream_url = stream_data
+    elif isinstance(stream_data, dict):
+        # Try different possible keys
+        stream_url = (
+            stream_data.get("url") or
+            stream_data.get("stream_url") or
+            stream_data.get("streamUrl") or
+            stream_data.get("ULTRA_HD") or
+            stream_data.get("HD") or
+            stream_data.get("HIGH") or
+            stream_data.get("STANDARD") or
+            stream_data.get("LOW")
+        )
+
+        # Check if there's a nested urls object
+        if not stream_url and "urls" in stream_data:
+            urls = stream_data["urls"]
+            if isinstance(urls, dict):
+                # Try quality levels
+                for quality in ["ULTRA_HD", "HD", "HIGH", "STANDARD", "LOW"]:
+                    if quality in urls:
+                        stream_url = urls[quality]
+                        break
+            elif isinstance(urls, list) and urls:
+                stream_url = urls[0]
+
+        # Try manifest URL
+        if not stream_url:
+            stream_url = stream_data.get("manifest") or stream_data.get("manifestUrl")
+
+    return stream_url
+
+def stream_countries() -> List[str]:
+    return STREAM_COUNTRIES or [DEFAULT_COUNTRY]
+
+def stream_cache_key(video_id: str, country: Optional[str] = None) -> str:
+    """Stream cache key; without a country, for the region the track last resolved in"""
+    if not country and len(STREAM_COUNTRIES) > 1:
+        country = region_index.local.get(video_id)
+    return f"{video_id}_{country or DEFAULT_COUNTRY}"
+
+async def resolve_stream(video_id: str, country: Optional[str] = None) -> dict:
     """
-    Get streaming URL for a track.
-    
-    Parameters:
-    - video_id: Amazon Music track ID (ASIN)
-    - country: Country code (US, AU, JP) - optional, defaults to US
+    Resolve a track's stream URL and metadata, from cache when possible.
+
+    Without an explicit country, STREAM_COUNTRIES are tried as configured.
+    Raises HTTPException with the status /stream should return on failure.
     """
+    if country or len(STREAM_COUNTRIES) < 2:
+        return await resolve_stream_in(video_id, (country or DEFAULT_COUNTRY).upper())
+    return await resolve_stream_any(video_id, STREAM_COUNTRIES)
+
+async def resolve_stream_any(video_id: str, countries: List[str]) -> dict:
+    """
+    First playable stream URL from any of `countries`.
+
+    The region the track last resolved in goes first. In hedged mode the
+    next country starts when the previous one fails or hasn't answered
+    within STREAM_REGION_HEDGE_DELAY; in parallel mode all start at once.
+    Whichever succeeds first wins and the others are cancelled.
+    """
+    region_stats["lookups"] += 1
+    known = await region_index.get(video_id)
+    if known in countries:
+        region_stats["known"] += 1
+        countries = [known] + [c for c in countries if c != known]
+    delay = 0.0 if STREAM_REGION_MODE == "parallel" else STREAM_REGION_HEDGE_DELAY
+
+    queue = list(countries)
+    pending: Dict[asyncio.Task, str] = {}
+    errors: Dict[str, HTTPException] = {}
+    try:
+        while queue or pending:
+            if queue:
+                country = queue.pop(0)
+                pending[asyncio.create_task(resolve_stream_in(video_id, country))] = country
+                if delay <= 0 and queue:
+                    continue
+            done, _ = await asyncio.wait(
+                pending, timeout=delay if queue else None, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                country = pending.pop(task)
+                try:
+                    result = task.result()
+                except HTTPException as e:
+                    errors[country] = e
+                    continue
+                if country != countries[0]:
+                    region_stats["fallbacks"] += 1
+                if country != known:
+                    await region_index.set(video_id, country)
+                return result
+    finally:
+        for task in pending:
+            task.cancel()
+
+    # Upstream trouble outranks "not available here" when reporting
+    for country in countries:
+        if errors[country].status_code != 404:
+            raise errors[country]
+    region_stats["unavailable"] += 1
+    raise HTTPException(
+        status_code=404,
+        detail=f"Track not found or not available for streaming in {', '.join(countries)}."
+    )
+
+async def resolve_stream_in(video_id: str, country: str) -> dict:
+    """Stream URL and metadata in one country, from cache when possible"""
+    metadata_task = None
     try:
         # Check cache first
-        cache_key = f"{video_id}_{country or DEFAULT_COUNTRY}"
-        if cache_key in stream_cache:
-            cached = stream_cache[cache_key]
-            if time.time() < cached['expires']:
-                print(f"✅ Serving from cache: {video_id}")
-                return cached['data']
-            else:
-                del stream_cache[cache_key]
+        cache_key = f"{video_id}_{country}"
+        cached = await stream_cache.get(cache_key)
+        if cached is not None:
+            log.debug("stream cache hit", extra={"video_id": video_id})
+            prefetcher.mark_used(cache_key)
+            return cached
 
-        print(f"🎵 Fetching stream for: {video_id} (country: {country or DEFAULT_COUNTRY})")
-        
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-            # Call /stream_urls endpoint as per API documentation
-            params = {
-                "id": video_id,
-                "country": country or DEFAULT_COUNTRY
-            }
-            
-            print(f"  → GET /stream_urls with params: {params}")
-            
-            stream_response = await client.get(
-                f"{AMAZON_MUSIC_API}/stream_urls",
-                params=params,
-                headers=get_headers()
-            )
-            
-            print(f"  → Response status: {stream_response.status_code}")
-            
-            if stream_response.status_code != 200:
-                error_text = stream_response.text[:200]
-                print(f"  ❌ API Error {stream_response.status_code}: {error_text}")
-                
-                # Provide helpful error message
-                if stream_response.status_code == 401:
-                    raise HTTPException(
-                        status_code=401,
-                        detail="Authentication required. This API may need an auth token."
-                    )
-                elif stream_response.status_code == 404:
-                    raise HTTPException(
-                        status_code=404,
-                        detail="Track not found or not available for streaming in this region."
-                    )
-                else:
-                    raise HTTPException(
-                        status_code=stream_response.status_code,
-                        detail=f"Amazon Music API error: {stream_response.status_code}"
-                    )
-            
-            stream_data = stream_response.json()
-            print(f"  → Response data type: {type(stream_data)}")
-            if isinstance(stream_data, dict):
-                print(f"  → Response keys: {list(stream_data.keys())}")
-            
-            # Get track metadata
-            track_info = {}
-            try:
-                track_response = await client.get(
-                    f"{AMAZON_MUSIC_API}/track",
-                    params={"id": video_id},
-                    headers=get_headers()
-                )
-                
-                if track_response.status_code == 200:
-                    track_data = track_response.json()
-                    track_info = track_data.get("track") or track_data.get("data") or track_data
-            except Exception as e:
-                print(f"  ⚠️ Could not fetch track metadata: {e}")
-            
-            # Extract stream URL - handle different response formats
-            stream_url = None
-            
-            if isinstance(stream_data, str):
-                # Direct URL string
-                stream_url = stream_data
-            elif isinstance(stream_data, dict):
-                # Try different possible keys
-                stream_url = (
-                    stream_data.get("url") or
-                    stream_data.get("stream_url") or
-                    stream_data.get("streamUrl") or
-                    stream_data.get("ULTRA_HD") or
-                    stream_data.get("HD") or
-                    stream_data.get("HIGH") or
-                    stream_data.get("STANDARD") or
-                    stream_data.get("LOW")
+        log.debug("resolving stream", extra={"video_id": video_id, "country": country})
+
+        # Track metadata is fetched alongside the stream URL, not after it
+        metadata_task = asyncio.create_task(fetch_track_metadata(video_id))
+
+        # Call /stream_urls endpoint as per API documentation
+        params = {
+            "id": video_id,
+            "country": country
+        }
+
+        stream_response = await upstream_get("/stream_urls", params, "stream")
+
+        if stream_response.status_code != 200:
+            log.info("stream_urls error", extra={
+                "video_id": video_id, "status": stream_response.status_code,
+                "body": stream_response.text[:200],
+            })
+
+            # Provide helpful error message
+            if stream_response.status_code == 401:
+                raise HTTPException(
+                    status_code=401,
+                    detail="Authentication required. This API may need an auth token."
                 )
-                
-                # Check if there's a nested urls object
-                if not stream_url and "urls" in stream_data:
-                    urls = stream_data["urls"]
-                    if isinstance(urls, dict):
-                        # Try quality levels
-                        for quality in ["ULTRA_HD", "HD", "HIGH", "STANDARD", "LOW"]:
-                            if quality in urls:
-                                stream_url = urls[quality]
-                                print(f"  ✅ Using {quality} quality")
-                                break
-                    elif isinstance(urls, list) and urls:
-                        stream_url = urls[0]
-                
-                # Try manifest URL
-                if not stream_url:
-                    stream_url = stream_data.get("manifest") or stream_data.get("manifestUrl")
-            
-            if not stream_url:
-                print(f"  ❌ No stream URL found in response: {stream_data}")
+            elif stream_response.status_code == 404:
                 raise HTTPException(
                     status_code=404,
-                    detail="No stream URL available. The track may require authentication or may not be available for streaming."
+                    detail="Track not found or not available for streaming in this region."
                 )
-            
-            # Extract artist name
-            artist_name = "Unknown"
-            if isinstance(track_info.get("artist"), dict):
-                artist_name = track_info.get("artist", {}).get("name", "Unknown")
-            elif isinstance(track_info.get("artist"), str):
-                artist_name = track_info.get("artist")
-            elif track_info.get("artists") and len(track_info.get("artists", [])) > 0:
-                first_artist = track_info.get("artists")[0]
-                if isinstance(first_artist, dict):
-                    artist_name = first_artist.get("name", "Unknown")
-                elif isinstance(first_artist, str):
-                    artist_name = first_artist
-            
-            result = {
-                "url": str(stream_url),
-                "title": str(track_info.get("title", "") or track_info.get("name", "Unknown")),
-                "thumbnail": str(track_info.get("cover", "") or track_info.get("image", "") or ""),
-                "artist": str(artist_name),
-                "duration": track_info.get("duration")
-            }
-            
-            # Cache for 1 hour
-            stream_cache[cache_key] = {
-                'data': result,
-                'expires': time.time() + CACHE_DURATION
-            }
-            
-            print(f"✅ Stream URL found: {result['title'][:50]}")
-            return result
-            
+            else:
+                raise HTTPException(
+                    status_code=stream_response.status_code,
+                    detail=f"Amazon Music API error: {stream_response.status_code}"
+                )
+
+        stream_data = stream_response.json()
+
+        # Extract stream URL - handle different response formats
+        stream_url = extract_stream_url(stream_data)
+        if not stream_url:
+            log.info("no stream URL in response", extra={"video_id": video_id, "response": str(stream_data)[:200]})
+            raise HTTPException(
+                status_code=404,
+                detail="No stream URL available. The track may require authentication or may not be available for streaming."
+            )
+
+        metadata = await metadata_task or {
+            "title": "Unknown",
+            "thumbnail": "",
+            "artist": "Unknown",
+            "duration": None
+        }
+
+        result = {"url": str(stream_url), "country": country, **metadata}
+
+        # Cache until the signed URL expires (at most 1 hour)
+        await stream_cache.set(cache_key, result, ttl=stream_url_ttl(result["url"]))
+
+        return result
+
     except HTTPException:
         raise
+    except UpstreamUnavailable as e:
+        raise upstream_unavailable(e)
     except Exception as e:
-        print(f"❌ Unexpected error in stream: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("unexpected error resolving stream", extra={"video_id": video_id})
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if metadata_task is not None and not metadata_task.done():
+            metadata_task.cancel()
+
+@app.get("/stream/{video_id}")
+async def get_stream_url(video_id: str, request: Request, country: Optional[str] = None):
+    """
+    Get streaming URL for a track.
+    
+    Parameters:
+    - video_id: Amazon Music track ID (ASIN)
+    - country: Country code (US, AU, JP) - optional; by default the first of
+      STREAM_COUNTRIES the track is available in (or just US)
+
+    The response's "country" is the region the URL was resolved in.
+    """
+    result = await resolve_stream(video_id, country)
+    # Prefetches call resolve_stream directly, so this is a real play
+    recommender.observe_play(client_id(request), video_id)
+    # Plays count for more than appearances in search results
+    title = result.get("title")
+    if title and title not in ("Unknown", "Unknown Title"):
+        autocomplete.add(normalize_query(title), title, "track", AUTOCOMPLETE_PLAY_WEIGHT)
+    return result
+
+async def open_audio(video_id: str, country: Optional[str], range_header: Optional[str]) -> httpx.Response:
+    """
+    Open a streaming upstream response for a track's audio.
+
+    A 401/403/404/410 from the CDN usually means the cached signed URL has
+    expired, so the URL is dropped from the cache, re-resolved and the
+    request retried once. A CDN that can't be reached raises a 502.
+    """
+    headers = {"Range": range_header} if range_header else {}
+
+    for attempt in range(2):
+        resolved = await resolve_stream(video_id, country)
+        cache_key = f"{video_id}_{resolved.get('country') or country or DEFAULT_COUNTRY}"
+        request = audio_client.build_request("GET", resolved["url"], headers=headers)
+        try:
+            response = await audio_client.send(request, stream=True)
+        except httpx.HTTPError as e:
+            log.warning("audio upstream unreachable", extra={"video_id": video_id, "error": repr(e)})
+            raise HTTPException(status_code=502, detail="Audio upstream unreachable")
+        if response.status_code not in (401, 403, 404, 410) or attempt == 1:
+            return response
+
+        await response.aclose()
+        log.debug("stream URL rejected, re-resolving", extra={"video_id": video_id, "status": response.status_code})
+        await stream_cache.delete(cache_key)
+
+async def iter_audio(response: httpx.Response) -> AsyncIterator[bytes]:
+    """
+    Relay upstream chunks as they arrive.
+
+    Each chunk is only read once the previous one has been handed to the
+    ASGI server, which waits for the client socket to drain, so a slow
+    listener slows the upstream read instead of filling memory.
+    """
+    try:
+        async for chunk in response.aiter_raw(AUDIO_CHUNK_SIZE):
+            yield chunk
+    finally:
+        await response.aclose()
+
+def parse_byte_range(range_header: str) -> Optional[tuple]:
+    """(start, end-or-None) for a single "bytes=a-" / "bytes=a-b" range"""
+    match = re.fullmatch(r"bytes=(\d+)-(\d*)", range_header.strip())
+    if not match:
+        return None
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) else None
+    if end is not None and end < start:
+        return None
+    return start, end
+
+async def fetch_segment(video_id: str, country: Optional[str], index: int) -> Optional[tuple]:
+    """
+    Download one aligned segment from upstream.
+
+    Returns (data, total_size, content_type), or None when upstream can't
+    serve byte ranges with a known total size.
+    """
+    size = segment_cache.segment_size
+    response = await open_audio(video_id, country, f"bytes={index * size}-{(index + 1) * size - 1}")
+    try:
+        content_range = response.headers.get("content-range", "")
+        total = content_range.rpartition("/")[2]
+        if response.status_code != 206 or not total.isdigit():
+            return None
+        data = await response.aread()
+        return data, int(total), response.headers.get("content-type", "audio/mpeg")
+    finally:
+        await response.aclose()
+
+async def fill_segment(video_id: str, country: Optional[str], index: int) -> Optional[tuple]:
+    """
+    Download one segment into the segment cache (and the track's meta if
+    it has none yet). Concurrent fills of the same segment share one
+    download. Returns what fetch_segment returned.
+    """
+    async def fill():
+        fetched = await fetch_segment(video_id, country, index)
+        if fetched is None:
+            return None
+        data, total, content_type = fetched
+        if segment_cache.meta(video_id) is None:
+            await segment_cache.set_meta(video_id, total, content_type)
+        await segment_cache.write(video_id, index, data)
+        return fetched
+
+    return await segment_flight.do((video_id, index), fill)
+
+async def serve_from_segments(video_id: str, country: Optional[str], start: int,
+                              end: Optional[int], ranged: bool) -> Optional[Response]:
+    """
+    Answer an audio request from the segment cache, filling missing
+    segments from upstream. Returns None if the track can't be cached.
+    """
+    meta = segment_cache.meta(video_id)
+    if meta is None:
+        if await fill_segment(video_id, country, start // segment_cache.segment_size) is None:
+            return None
+        meta = segment_cache.meta(video_id)
+        if meta is None:
+            return None  # evicted again straight away; stream it through
+
+    total = meta["total"]
+    if start >= total:
+        return Response(status_code=416, headers={"content-range": f"bytes */{total}"})
+    end = total - 1 if end is None else min(end, total - 1)
+
+    async def body() -> AsyncIterator[bytes]:
+        size = segment_cache.segment_size
+        for index in segment_cache.segments_for(start, end):
+            seg_start = max(start, index * size)
+            seg_end = min(end, (index + 1) * size - 1)
+            chunks = None
+            if segment_cache.has_segment(video_id, index):
+                try:
+                    chunks = await segment_cache.read(video_id, index, seg_start, seg_end, AUDIO_CHUNK_SIZE)
+                except OSError:
+                    pass  # evicted between the check and the read
+            if chunks is None:
+                fetched = await fill_segment(video_id, country, index)
+                if fetched is None:
+                    raise RuntimeError(f"Upstream stopped serving ranges for {video_id}")
+                data = fetched[0][seg_start - index * size:seg_end - index * size + 1]
+                chunks = [data[i:i + AUDIO_CHUNK_SIZE] for i in range(0, len(data), AUDIO_CHUNK_SIZE)]
+            for chunk in chunks:
+                yield chunk
+
+    headers = {
+        "accept-ranges": "bytes",
+        "content-length": str(end - start + 1),
+        "cache-control": "private, max-age=3600",
+    }
+    if ranged:
+        headers["content-range"] = f"bytes {start}-{end}/{total}"
+    return StreamingResponse(
+        body(),
+        status_code=206 if ranged else 200,
+        headers=headers,
+        media_type=meta["content_type"]
+    )
+
+@app.get("/audio/{video_id}")
+async def proxy_audio(video_id: str, request: Request, country: Optional[str] = None):
+    """
+    Same-origin audio for a track, proxied from its signed stream URL.
+
+    Honors single byte-range requests for seeking and never buffers the
+    whole file. The URL the browser sees never expires; the signed one
+    behind it is re-resolved transparently.
+    """
+    range_header = request.headers.get("range")
+    if range_header and (not range_header.startswith("bytes=") or "," in range_header):
+        range_header = None  # multi-range or non-byte units: serve the full body
+
+    # Hot tracks are served from local segments; a play starts at byte 0
+    byte_range = parse_byte_range(range_header) if range_header else (0, None)
+    if segment_cache is not None and byte_range is not None:
+        if byte_range[0] == 0:
+            segment_cache.record_play(video_id)
+        if segment_cache.is_admitted(video_id):
+            cached = await serve_from_segments(video_id, country, *byte_range, ranged=range_header is not None)
+            if cached is not None:
+                return cached
+
+    response = await open_audio(video_id, country, range_header)
+    if response.status_code not in (200, 206, 416):
+        await response.aclose()
+        raise HTTPException(status_code=502, detail=f"Audio upstream error: {response.status_code}")
+
+    headers = {k: response.headers[k] for k in AUDIO_PASSTHROUGH_HEADERS if k in response.headers}
+    headers.setdefault("accept-ranges", "bytes")
+    headers["cache-control"] = "private, max-age=3600"
+
+    return StreamingResponse(
+        iter_audio(response),
+        status_code=response.status_code,
+        headers=headers,
+        media_type=response.headers.get("content-type", "audio/mpeg")
+    )
+
+class BatchRequest(BaseModel):
+    ids: List[str]
+    country: Optional[str] = None
+
+async def resolve_batch(ids: List[str], resolve) -> AsyncIterator[bytes]:
+    """
+    Resolve ids concurrently (at most BATCH_CONCURRENCY at a time) and
+    yield one NDJSON line per id as soon as it is ready.
+    """
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def one(video_id: str) -> dict:
+        async with semaphore:
+            try:
+                return {"id": video_id, "ok": True, "data": await resolve(video_id)}
+            except HTTPException as e:
+                return {"id": video_id, "ok": False, "status": e.status_code, "error": e.detail}
+            except Exception as e:
+                return {"id": video_id, "ok": False, "status": 500, "error": str(e)}
+
+    tasks = [asyncio.create_task(one(video_id)) for video_id in ids]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield orjson.dumps(await next_done) + b"\n"
+    finally:
+        # Client went away mid-stream: stop resolving what's left
+        for task in tasks:
+            task.cancel()
+
+def batch_ids(body: BatchRequest) -> List[str]:
+    ids = list(dict.fromkeys(i for i in body.ids if i))
+    if len(ids) > BATCH_MAX_IDS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_IDS} ids per batch")
+    return ids
+
+@app.post("/stream/batch")
+async def stream_batch(body: BatchRequest):
+    """
+    Resolve stream URLs for many tracks in one round trip.
+
+    Streams NDJSON, one line per id in completion order:
+    {"id", "ok": true, "data": <same as /stream>} or
+    {"id", "ok": false, "status", "error"}.
+    """
+    ids = batch_ids(body)
+    return StreamingResponse(
+        resolve_batch(ids, lambda video_id: resolve_stream(video_id, body.country)),
+        media_type="application/x-ndjson"
+    )
+
+@app.post("/tracks/batch")
+async def tracks_batch(body: BatchRequest):
+    """Track metadata (title, artist, thumbnail, duration) for many tracks, as NDJSON"""
+    ids = batch_ids(body)
+
+    async def resolve(video_id: str) -> dict:
+        metadata = await fetch_track_metadata(video_id)
+        if metadata is None:
+            raise HTTPException(status_code=404, detail="Track metadata unavailable")
+        return metadata
+
+    return StreamingResponse(resolve_batch(ids, resolve), media_type="application/x-ndjson")
+
+class HistoryEvent(BaseModel):
+    video_id: str
+    title: Optional[str] = None
+    artist: Optional[str] = None
+    thumbnail: Optional[str] = None
+    played_at: Optional[datetime] = None
+    event_id: Optional[uuid.UUID] = None  # lets clients retry without duplicates
+
+@app.post("/history", status_code=202)
+async def post_history(events: Union[HistoryEvent, List[HistoryEvent]], request: Request):
+    """
+    Record plays for the signed-in user.
+
+    Takes one event or a list, with the user's Supabase access token as
+    `Authorization: Bearer ...`. Events are written to Supabase in batches,
+    so they show up in `history` a few seconds later.
+    """
+    if history_writer is None:
+        raise HTTPException(status_code=503, detail="History ingestion is not configured")
+
+    auth = request.headers.get("authorization", "")
+    user_id = None
+    if auth[:7].lower() == "bearer ":
+        user_id = verify_supabase_token(auth[7:], SUPABASE_JWT_SECRET)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid or expired session")
+
+    if not isinstance(events, list):
+        events = [events]
+    if len(events) > HISTORY_MAX_EVENTS:
+        raise HTTPException(status_code=413, detail=f"At most {HISTORY_MAX_EVENTS} events per request")
+
+    now = datetime.now(timezone.utc).isoformat()
+    rows = [
+        {
+            "event_id": str(e.event_id or uuid.uuid4()),
+            "user_id": user_id,
+            "video_id": e.video_id,
+            "title": e.title,
+            "artist": e.artist,
+            "thumbnail": e.thumbnail,
+            "played_at": e.played_at.isoformat() if e.played_at else now,
+        }
+        for e in events
+    ]
+    if not history_writer.add(rows):
+        raise HTTPException(
+            status_code=503,
+            detail="History is backed up, please retry shortly.",
+            headers={"Retry-After": "30"}
+        )
+    return {"accepted": len(rows)}
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
@@ -0,0 +1,161 @@
+from dataclasses import dataclass
+from typing import Any, List, Optional
+
+
+@dataclass(slots=True)
+class Track:
+    """
+    A track in the frontend's wire format.
+
+    Field names match the JSON the frontend reads, so orjson can serialize
+    instances directly without an intermediate dict.
+    """
+
+    videoId: str
+    title: str
+    artists: List[dict]
+    album: dict
+    duration: Optional[int]
+    duration_seconds: Optional[int]
+    thumbnails: List[dict]
+    isExplicit: bool
+    year: Any
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Track":
+        return cls(**data)
+
+
+UNKNOWN_ARTISTS = ({"name": "Unknown Artist", "id": ""},)
+UNKNOWN_ALBUM = {"name": "Unknown Album", "id": ""}
+
+
+def _str(value: Any) -> str:
+    return value if type(value) is str else str(value)
+
+
+def _artist(artist: Any) -> Optional[dict]:
+    if isinstance(artist, dict):
+        return {
+            "name": _str(artist.get("name", "Unknown")),
+            "id": _str(artist.get("id") or artist.get("asin") or ""),
+        }
+    if isinstance(artist, str):
+        return {"name": artist, "id": ""}
+    return None
+
+
+def _artists(raw_artists: Any, raw_artist: Any) -> List[dict]:
+    artists = []
+    if isinstance(raw_artists, list):
+        for raw in raw_artists:
+            artist = _artist(raw)
+            if artist is not None:
+                artists.append(artist)
+    else:
+        artist = _artist(raw_artist)
+        if artist is not None:
+            artists.append(artist)
+    return artists or [dict(a) for a in UNKNOWN_ARTISTS]
+
+
+def _cover(get) -> List[dict]:
+    cover_url = get("cover") or get("image") or get("artwork") or get("thumbnail")
+    return [{"url": _str(cover_url), "width": 500, "height": 500}] if cover_url else []
+
+
+def transform_track(amz_track: Any) -> Optional[Track]:
+    """
+    Normalize an Amazon Music track into a Track in a single pass.
+
+    Returns None for payloads that aren't a dict or carry no track id,
+    instead of a placeholder the caller would have to filter out.
+    """
+    if not isinstance(amz_track, dict):
+        return None
+    get = amz_track.get
+
+    track_id = get("id") or get("trackId") or get("asin")
+    if not track_id:
+        return None
+
+    artists = _artists(get("artists"), get("artist"))
+
+    # Extract album
+    album_data = get("album")
+    if isinstance(album_data, dict):
+        album = {
+            "name": _str(album_data.get("title") or album_data.get("name") or "Unknown Album"),
+            "id": _str(album_data.get("id") or album_data.get("asin") or ""),
+        }
+    elif isinstance(album_data, str):
+        album = {"name": album_data, "id": ""}
+    else:
+        album = dict(UNKNOWN_ALBUM)
+
+    thumbnails = _cover(get)
+
+    duration = get("duration") or get("durationSeconds")
+    if duration and type(duration) is not int:
+        try:
+            duration = int(duration)
+        except (ValueError, TypeError):
+            duration = None
+
+    return Track(
+        videoId=_str(track_id),
+        title=_str(get("title") or get("name") or "Unknown Title"),
+        artists=artists,
+        album=album,
+        duration=duration,
+        duration_seconds=duration,
+        thumbnails=thumbnails,
+        isExplicit=bool(get("explicit", False)),
+        year=get("year") or get("releaseYear") or None,
+    )
+
+
+def transform_tracks(raw_tracks: List[Any], limit: int) -> List[Track]:
+    tracks = []
+    for raw in raw_tracks[:limit]:
+        track = transform_track(raw)
+        if track is not None:
+            tracks.append(track)
+    return tracks
+
+
+def transform_album(amz_album: Any) -> Optional[dict]:
+    """
+    Normalize an Amazon Music album into the card the artist page shows.
+
+    Album cards are plain dicts: unlike tracks they're only ever built for
+    the artist page, so there's no hot path to optimize.
+    """
+    if not isinstance(amz_album, dict):
+        return None
+    get = amz_album.get
+
+    album_id = get("id") or get("albumId") or get("asin")
+    if not album_id:
+        return None
+    return {
+        "browseId": _str(album_id),
+        "title": _str(get("title") or get("name") or "Unknown Album"),
+        "artists": _artists(get("artists"), get("artist")),
+        "thumbnails": _cover(get),
+        "year": get("year") or get("releaseYear") or None,
+    }
+
+
+def album_of(track: Track) -> Optional[dict]:
+    """Album card for the album a track is on, playing that track when clicked"""
+    if not track.album["id"]:
+        return None
+    return {
+        "browseId": track.album["id"],
+        "title": track.album["name"],
+        "artists": track.artists[:1],
+        "thumbnails": track.thumbnails,
+        "year": track.year,
+        "videoId": track.videoId,
+    }
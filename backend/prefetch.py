@@ -0,0 +1,96 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Set
+
+from cache import TTLCache
+
+
+class Prefetcher:
+    """
+    Background warming of caches for tracks a client is likely to play next.
+
+    At most `max_concurrency` prefetches run at once and at most
+    `max_pending` wait behind them; anything beyond that is dropped, since
+    a late prefetch is worthless. Each user may schedule `user_budget`
+    prefetches per `budget_window` seconds.
+
+    Keys that were warmed are remembered for `hit_window` seconds so that
+    `mark_used()` can tell whether a later cache hit came from a prefetch.
+    """
+
+    def __init__(self, max_concurrency: int = 4, max_pending: int = 64,
+                 user_budget: int = 30, budget_window: float = 60.0,
+                 hit_window: float = 1800.0):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.user_budget = user_budget
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._keys: Set[str] = set()
+        self._budgets = TTLCache("prefetch-budgets", max_entries=10000, default_ttl=budget_window)
+        self._warmed = TTLCache("prefetch-warmed", max_entries=20000, default_ttl=hit_window)
+        self.scheduled = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.over_budget = 0
+        self.hits = 0
+
+    def schedule(self, user: str, key: str, fn: Callable[[], Awaitable[Any]]) -> bool:
+        """Queue `fn` to warm `key`; returns False if it was skipped"""
+        if key in self._keys:
+            return False
+        if len(self._tasks) >= self.max_concurrency + self.max_pending:
+            self.dropped += 1
+            return False
+
+        used = self._budgets.get(user, 0)
+        if used >= self.user_budget:
+            self.over_budget += 1
+            return False
+        # Keep the window that started with the user's first prefetch
+        self._budgets.set(user, used + 1, ttl=self._budgets.ttl(user))
+
+        self._keys.add(key)
+        task = asyncio.create_task(self._run(key, fn))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.scheduled += 1
+        return True
+
+    async def _run(self, key: str, fn: Callable[[], Awaitable[Any]]):
+        try:
+            async with self._semaphore:
+                await fn()
+            self._warmed.set(key, True)
+            self.completed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.failed += 1
+        finally:
+            self._keys.discard(key)
+
+    def mark_used(self, key: str) -> bool:
+        """Record a cache hit on `key`; True if a prefetch had warmed it"""
+        if self._warmed.delete(key):
+            self.hits += 1
+            return True
+        return False
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": min(len(self._tasks), self.max_concurrency),
+            "queued": max(0, len(self._tasks) - self.max_concurrency),
+            "scheduled": self.scheduled,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "over_budget": self.over_budget,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.completed, 3) if self.completed else 0.0,
+        }
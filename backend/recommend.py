@@ -0,0 +1,314 @@
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from cache import TTLCache
+from models import Track
+
+
+def _title_key(title: str) -> str:
+    """Title without "(Remastered)", "[Live]", " - Radio Edit" and the like"""
+    title = re.sub(r"\s*[\(\[].*?[\)\]]", "", title)
+    return title.split(" - ")[0].casefold().strip()
+
+
+class Recommender:
+    """
+    Radio recommendations from a co-occurrence graph of tracks.
+
+    Tracks that appear near each other in search results and charts, or are
+    played one after the other by the same listener, get an edge whose
+    weight grows with every sighting. Artists get the same treatment, which
+    lets the engine suggest an artist's tracks that were never seen next to
+    the seed.
+
+    `related()` scores a seed's candidates (graph neighbours plus tracks by
+    the seed's and similar artists) with NumPy, keeps the ranking until the
+    seed's neighbourhood changes, and applies a per-artist cap and
+    duplicate-title filter when picking results.
+
+    Past `max_tracks`, weights are halved and the least popular 10% of
+    tracks are dropped. Halving is done by doubling the scale new weights
+    are added at, and dropping is spread over the following calls
+    (`compact_step` tracks each) with freed slots reused, so no single call
+    pays for the whole graph.
+    """
+
+    def __init__(self, max_tracks: int = 50000, window: int = 5, max_edges: int = 64,
+                 neighbors: int = 100, artist_cap: int = 3, session_ttl: float = 1800.0,
+                 compact_step: int = 250):
+        self.max_tracks = max_tracks
+        self.window = window
+        self.max_edges = max_edges
+        self.neighbors = neighbors
+        self.artist_cap = artist_cap
+        self.compact_step = compact_step
+        self._sessions = TTLCache("recommend-sessions", max_entries=20000, default_ttl=session_ttl)
+        self._reset()
+        self.lookups = 0
+        self.hits = 0
+        self.compactions = 0
+
+    def _reset(self):
+        self._index: Dict[str, int] = {}
+        self._tracks: List[Optional[Track]] = []  # None for a freed slot
+        self._free: List[int] = []
+        self._dropping: List[int] = []  # slots still to drop in this compaction
+        self._drop_below = 0.0
+        self._scale = 1.0  # weights are stored multiplied by this
+        self._edges: List[Dict[int, float]] = []
+        self._popularity = np.zeros(1024, dtype=np.float64)
+        self._primary_artist = np.zeros(1024, dtype=np.int32)
+        self._artist_index: Dict[str, int] = {}
+        self._artist_names: List[str] = []
+        self._artist_tracks: List[Set[int]] = []
+        self._artist_edges: List[Dict[int, float]] = []
+        # seed -> (its artist's track count when ranked, ranking)
+        self._ranked: Dict[int, Tuple[int, np.ndarray]] = {}
+
+    # Feeding the graph
+
+    def observe_list(self, tracks: Iterable[Track], weight: float = 1.0):
+        """Tracks shown together (one search result page or chart)"""
+        self._compact_some()
+        weight *= self._scale
+        ids = [self._add(t) for t in tracks]
+        ids = [i for i in ids if i is not None]
+        for pos, a in enumerate(ids):
+            self._popularity[a] += weight / (1 + pos / 10)
+            for dist in range(1, self.window + 1):
+                if pos + dist >= len(ids):
+                    break
+                b = ids[pos + dist]
+                self._link(a, b, weight / dist)
+        if len(self._index) > self.max_tracks and not self._dropping:
+            self._start_compaction()
+
+    def observe_play(self, user: str, video_id: str, weight: float = 3.0):
+        """A listener played `video_id`; links it to their previous play"""
+        weight *= self._scale
+        previous = self._sessions.get(user)
+        self._sessions.set(user, video_id)
+        current = self._index.get(video_id)
+        if current is None:
+            return
+        self._popularity[current] += weight
+        before = self._index.get(previous) if previous else None
+        if before is not None and before != current:
+            self._link(before, current, weight)
+
+    # Queries
+
+    def artist_of(self, video_id: str) -> Optional[str]:
+        i = self._index.get(video_id)
+        if i is None:
+            return None
+        return self._artist_names[self._primary_artist[i]]
+
+    def popular(self, limit: int) -> List[str]:
+        """Video ids of the `limit` most played and most seen tracks"""
+        if not self._index or limit <= 0:
+            return []
+        live = np.fromiter(self._index.values(), dtype=np.int64, count=len(self._index))
+        top = min(limit, len(live))
+        scores = self._popularity[live]
+        best = np.argpartition(-scores, top - 1)[:top]
+        return [self._tracks[i].videoId for i in live[best[np.argsort(-scores[best], kind="stable")]]]
+
+    def related(self, video_id: str, limit: int, exclude: Iterable[str] = ()) -> List[Track]:
+        """Up to `limit` tracks to play after `video_id`, best first"""
+        self.lookups += 1
+        seed = self._index.get(video_id)
+        if seed is None:
+            return []
+
+        # Re-rank when the seed's edges changed or its artist gained tracks
+        artist_size = len(self._artist_tracks[self._primary_artist[seed]])
+        cached = self._ranked.get(seed)
+        if cached is None or cached[0] != artist_size:
+            cached = self._ranked[seed] = (artist_size, self._rank(seed))
+        ranked = cached[1]
+
+        skip = set(exclude)
+        seed_track = self._tracks[seed]
+        titles = {(_title_key(seed_track.title), int(self._primary_artist[seed]))}
+        per_artist: Dict[int, int] = {}
+        picked = []
+        for i in ranked:
+            track = self._tracks[i]
+            if track is None or track.videoId in skip:
+                continue
+            artist = int(self._primary_artist[i])
+            if per_artist.get(artist, 0) >= self.artist_cap:
+                continue
+            title = (_title_key(track.title), artist)
+            if title in titles:
+                continue
+            titles.add(title)
+            per_artist[artist] = per_artist.get(artist, 0) + 1
+            picked.append(track)
+            if len(picked) >= limit:
+                break
+
+        if len(picked) >= limit:
+            self.hits += 1
+        return picked
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tracks": len(self._index),
+            "artists": len(self._artist_names),
+            "edges": sum(len(e) for e in self._edges) // 2,
+            "ranked": len(self._ranked),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_ratio": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            "compactions": self.compactions,
+        }
+
+    # Internals
+
+    def _add(self, track: Track) -> Optional[int]:
+        i = self._index.get(track.videoId)
+        if i is not None:
+            self._tracks[i] = track  # keep the freshest metadata
+            return i
+        name = track.artists[0]["name"] if track.artists else ""
+        if not name or name == "Unknown Artist":
+            return None
+
+        if self._free:
+            i = self._free.pop()
+            self._tracks[i] = track
+            self._popularity[i] = 0.0
+        else:
+            i = len(self._tracks)
+            if i >= len(self._popularity):
+                self._popularity = np.concatenate([self._popularity, np.zeros_like(self._popularity)])
+                self._primary_artist = np.concatenate([self._primary_artist, np.zeros_like(self._primary_artist)])
+            self._tracks.append(track)
+            self._edges.append({})
+        self._index[track.videoId] = i
+
+        artist = self._artist(name)
+        self._primary_artist[i] = artist
+        self._artist_tracks[artist].add(i)
+        for other in track.artists[1:]:
+            if other["name"] and other["name"] != "Unknown Artist":
+                self._link_artists(artist, self._artist(other["name"]), self._scale)
+        return i
+
+    def _artist(self, name: str) -> int:
+        key = name.casefold()
+        a = self._artist_index.get(key)
+        if a is None:
+            a = self._artist_index[key] = len(self._artist_names)
+            self._artist_names.append(name)
+            self._artist_tracks.append(set())
+            self._artist_edges.append({})
+        return a
+
+    def _link(self, a: int, b: int, weight: float):
+        for x, y in ((a, b), (b, a)):
+            edges = self._edges[x]
+            edges[y] = edges.get(y, 0.0) + weight
+            self._ranked.pop(x, None)
+        for x in (a, b):
+            edges = self._edges[x]
+            if len(edges) > 2 * self.max_edges:
+                ordered = sorted(edges.items(), key=lambda e: e[1], reverse=True)
+                self._edges[x] = dict(ordered[:self.max_edges])
+                # Edges stay symmetric, so dropping a track can find every edge to it
+                for z, _ in ordered[self.max_edges:]:
+                    self._edges[z].pop(x, None)
+                    self._ranked.pop(z, None)
+        self._link_artists(int(self._primary_artist[a]), int(self._primary_artist[b]), weight)
+
+    def _link_artists(self, a: int, b: int, weight: float):
+        if a == b:
+            return
+        for x, y in ((a, b), (b, a)):
+            edges = self._artist_edges[x]
+            edges[y] = edges.get(y, 0.0) + weight
+            if len(edges) > 2 * self.max_edges:
+                self._artist_edges[x] = dict(sorted(edges.items(), key=lambda e: e[1], reverse=True)[:self.max_edges])
+
+    def _rank(self, seed: int) -> np.ndarray:
+        """Candidate track indices for `seed`, best first"""
+        seed_artist = int(self._primary_artist[seed])
+
+        # Artist affinity: 1 for the seed's artist, up to 0.6 for similar ones
+        artist_score = np.zeros(len(self._artist_names), dtype=np.float64)
+        similar = sorted(self._artist_edges[seed_artist].items(), key=lambda e: e[1], reverse=True)[:10]
+        if similar:
+            ids = np.fromiter((a for a, _ in similar), dtype=np.int64, count=len(similar))
+            weights = np.fromiter((w for _, w in similar), dtype=np.float64, count=len(similar))
+            artist_score[ids] = 0.6 * weights / weights.max()
+        artist_score[seed_artist] = 1.0
+
+        edges = self._edges[seed]
+        candidates = set(edges)
+        candidates.update(self._artist_tracks[seed_artist])
+        for a, _ in similar:
+            candidates.update(self._artist_tracks[a])
+        candidates.discard(seed)
+        if not candidates:
+            return np.zeros(0, dtype=np.int64)
+
+        cand = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        cooc = np.fromiter((edges.get(c, 0.0) for c in candidates), dtype=np.float64, count=len(candidates))
+        popularity = np.log1p(self._popularity[cand] / self._scale)
+
+        score = artist_score[self._primary_artist[cand]] * 0.5
+        if cooc.max() > 0:
+            score += cooc / cooc.max()
+        if popularity.max() > 0:
+            score += 0.2 * popularity / popularity.max()
+
+        top = min(self.neighbors, len(cand))
+        best = np.argpartition(-score, top - 1)[:top]
+        return cand[best[np.argsort(-score[best], kind="stable")]]
+
+    def _start_compaction(self):
+        """Halve every weight and queue the least popular tenth of tracks for dropping"""
+        self.compactions += 1
+        self._scale *= 2
+        if self._scale > 2.0 ** 64:
+            self._rescale()
+
+        live = np.fromiter(self._index.values(), dtype=np.int64, count=len(self._index))
+        drop = max(1, len(live) // 10)
+        scores = self._popularity[live]
+        lightest = np.argpartition(scores, drop - 1)[:drop]
+        self._drop_below = float(scores[lightest].max())
+        self._dropping = live[lightest].tolist()
+
+    def _compact_some(self):
+        """Drop the next `compact_step` queued tracks"""
+        if not self._dropping:
+            return
+        batch = self._dropping[-self.compact_step:]
+        del self._dropping[-self.compact_step:]
+        for i in batch:
+            track = self._tracks[i]
+            # Tracks seen again since the compaction started are kept
+            if track is None or self._popularity[i] > self._drop_below:
+                continue
+            edges, self._edges[i] = self._edges[i], {}
+            for j in edges:
+                self._edges[j].pop(i, None)
+            del self._index[track.videoId]
+            self._artist_tracks[self._primary_artist[i]].discard(i)
+            self._tracks[i] = None
+            self._free.append(i)
+        # Cached rankings may name freed (and soon reused) slots
+        self._ranked.clear()
+
+    def _rescale(self):
+        """Fold the accumulated scale back into the weights (rare)"""
+        scale, self._scale = self._scale, 1.0
+        self._popularity /= scale
+        for edges in (self._edges, self._artist_edges):
+            for i, e in enumerate(edges):
+                edges[i] = {k: w / scale for k, w in e.items()}
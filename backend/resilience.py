@@ -0,0 +1,282 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Type
+
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling upstream when a route is shedding load"""
+
+    def __init__(self, route: str, reason: str):
+        super().__init__(f"{route}: {reason}")
+        self.route = route
+        self.reason = reason
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter with an adaptive rate.
+
+    The refill rate is halved whenever upstream signals overload and grows
+    back additively on success (AIMD), never exceeding `max_rate`.
+    """
+
+    def __init__(self, max_rate: float, burst: float, min_rate: float = 1.0):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = max_rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self.throttled = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, max_wait: float) -> bool:
+        """Take a token, waiting at most `max_wait` seconds for one"""
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+
+        # Reserve the token before sleeping, so concurrent waiters queue up
+        # behind each other instead of all waking to the same refill
+        wait = (1 - self._tokens) / self.rate
+        if wait > max_wait:
+            self.throttled += 1
+            return False
+        self._tokens -= 1
+        try:
+            await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            self._tokens += 1  # hand the reservation back
+            raise
+        return True
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+    def on_overload(self):
+        self.rate = max(self.min_rate, self.rate / 2)
+
+
+class CircuitBreaker:
+    """
+    Opens when the recent error rate or mean latency crosses a threshold.
+
+    Outcomes from the last `window` seconds are kept. Once at least
+    `min_calls` have been seen and either threshold is crossed, the breaker
+    opens for `cooldown` seconds, then lets a single probe through
+    (half-open); the probe's outcome closes or re-opens it.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, error_rate: float = 0.5, latency: float = 10.0,
+                 min_calls: int = 20, window: float = 30.0, cooldown: float = 15.0):
+        self.error_rate = error_rate
+        self.latency = latency
+        self.min_calls = min_calls
+        self.window = window
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._outcomes: deque = deque()
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.cooldown:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self._probing = False
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                self.rejected += 1
+                return False
+            self._probing = True
+        return True
+
+    def record(self, ok: bool, latency: float):
+        now = time.monotonic()
+        if self.state == self.HALF_OPEN:
+            if ok and latency < self.latency:
+                self.state = self.CLOSED
+                self._outcomes.clear()
+            else:
+                self._open(now)
+            return
+
+        self._outcomes.append((now, ok, latency))
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            self._outcomes.popleft()
+
+        calls = len(self._outcomes)
+        if self.state == self.CLOSED and calls >= self.min_calls:
+            errors = sum(1 for _, success, _ in self._outcomes if not success)
+            mean_latency = sum(l for _, _, l in self._outcomes) / calls
+            if errors / calls >= self.error_rate or mean_latency >= self.latency:
+                self._open(now)
+
+    def abandon(self):
+        """The allowed call ended without an outcome (e.g. cancelled)"""
+        if self.state == self.HALF_OPEN:
+            self._probing = False
+
+    def _open(self, now: float):
+        self.state = self.OPEN
+        self._opened_at = now
+        self._probing = False
+        self._outcomes.clear()
+        self.opened += 1
+
+
+class RetryBudget:
+    """
+    Caps retries and hedges at `ratio` of recent requests (plus a small
+    floor), so retrying can never multiply load on a struggling upstream.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_window: int = 5, window: float = 10.0):
+        self.ratio = ratio
+        self.min_per_window = min_per_window
+        self.window = window
+        self._requests: deque = deque()
+        self._retries: deque = deque()
+        self.exhausted = 0
+
+    def _trim(self, now: float):
+        for q in (self._requests, self._retries):
+            while q and now - q[0] > self.window:
+                q.popleft()
+
+    def record_request(self):
+        self._requests.append(time.monotonic())
+
+    def try_spend(self) -> bool:
+        now = time.monotonic()
+        self._trim(now)
+        if len(self._retries) >= self.min_per_window + self.ratio * len(self._requests):
+            self.exhausted += 1
+            return False
+        self._retries.append(now)
+        return True
+
+
+class ResiliencePolicy:
+    """
+    Rate limiting, circuit breaking, budgeted retries and hedging for the
+    calls to one upstream route.
+
+    `call()` is only for idempotent requests: a slow attempt is hedged after
+    `hedge_delay` seconds (0 disables hedging) and failed attempts are
+    retried with full-jitter exponential backoff, both paid for from the
+    shared retry budget.
+    """
+
+    def __init__(self, route: str, limiter: TokenBucket, breaker: CircuitBreaker,
+                 budget: RetryBudget, max_attempts: int = 3, backoff: float = 0.2,
+                 hedge_delay: float = 0.0, max_wait: float = 0.5,
+                 retry_on: Tuple[Type[BaseException], ...] = (),
+                 is_failure: Callable[[Any], bool] = lambda result: False):
+        self.route = route
+        self.limiter = limiter
+        self.breaker = breaker
+        self.budget = budget
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.hedge_delay = hedge_delay
+        self.max_wait = max_wait
+        self.retry_on = retry_on
+        self.is_failure = is_failure
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    async def call(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if not await self.limiter.acquire(self.max_wait):
+            raise UpstreamUnavailable(self.route, "rate limited")
+        if not self.breaker.allow():
+            raise UpstreamUnavailable(self.route, "circuit open")
+        self.budget.record_request()
+        self.calls += 1
+
+        attempt = 1
+        while True:
+            started = time.monotonic()
+            error: Optional[BaseException] = None
+            result = None
+            try:
+                result = await self._hedged(fn)
+                failed = self.is_failure(result)
+            except self.retry_on as e:
+                error = e
+                failed = True
+            except BaseException:
+                self.breaker.abandon()
+                raise
+
+            self.breaker.record(not failed, time.monotonic() - started)
+            if not failed:
+                self.limiter.on_success()
+                return result
+            self.limiter.on_overload()
+
+            if attempt >= self.max_attempts or not self.budget.try_spend() or not self.breaker.allow():
+                if error is not None:
+                    raise error
+                return result
+
+            self.retries += 1
+            await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            attempt += 1
+
+    async def _hedged(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if self.hedge_delay <= 0:
+            return await fn()
+
+        primary = asyncio.ensure_future(fn())
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_delay)
+            if done or not self.budget.try_spend():
+                return await primary
+
+            self.hedges += 1
+            hedge = asyncio.ensure_future(fn())
+            pending = {primary, hedge}
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                if not pending:
+                    return done.pop().result()
+        finally:
+            # The losing attempt, or everything if we were cancelled
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.breaker.state,
+            "rate": round(self.limiter.rate, 2),
+            "calls": self.calls,
+            "throttled": self.limiter.throttled,
+            "breaker_opened": self.breaker.opened,
+            "breaker_rejected": self.breaker.rejected,
+            "retries": self.retries,
+            "retry_budget_exhausted": self.budget.exhausted,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
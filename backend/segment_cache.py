@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+
+from cache import TTLCache
+
+
+class SegmentCache:
+    """
+    On-disk cache of audio bytes split into fixed-size segments.
+
+    Each track gets a directory holding `meta.json` (total size and content
+    type) and one file per cached segment. Segments are evicted least
+    recently used once `max_bytes` is exceeded; a track whose last segment
+    goes is forgotten entirely, directory and all. Reads go through `mmap`,
+    so hot segments are served from the page cache.
+
+    A track is only admitted after `admit_after` plays within
+    `admit_window` seconds, so one-off plays stream straight through
+    instead of evicting the hot set.
+    """
+
+    def __init__(self, directory: str, segment_size: int = 1024 * 1024,
+                 max_bytes: int = 2 * 1024 ** 3, admit_after: int = 2,
+                 admit_window: float = 3600.0):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.admit_after = admit_after
+        self._plays = TTLCache("segment-plays", max_entries=50000, default_ttl=admit_window)
+        self._meta: Dict[str, Dict[str, Any]] = {}
+        self._segments: "OrderedDict[Tuple[str, int], int]" = OrderedDict()
+        self._track_segments: Dict[str, int] = {}  # cached segments per track
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+        self.bytes_written = 0
+        self.evictions = 0
+        self.admissions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    # Admission
+
+    def record_play(self, key: str) -> bool:
+        """Count a play of `key`; True once it qualifies for caching"""
+        plays = self._plays.get(key, 0) + 1
+        self._plays.set(key, plays, ttl=self._plays.ttl(key))
+        if plays == self.admit_after:
+            self.admissions += 1
+        return plays >= self.admit_after or key in self._meta
+
+    def is_admitted(self, key: str) -> bool:
+        return key in self._meta or self._plays.get(key, 0) >= self.admit_after
+
+    # Lookup
+
+    def meta(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._meta.get(key)
+
+    def segments_for(self, start: int, end: int) -> range:
+        return range(start // self.segment_size, end // self.segment_size + 1)
+
+    def has_segment(self, key: str, index: int) -> bool:
+        return (key, index) in self._segments
+
+    async def read(self, key: str, index: int, start: int, end: int, chunk_size: int) -> List[bytes]:
+        """Bytes [start, end] (inclusive, track offsets) of one cached segment"""
+        offset = index * self.segment_size
+        chunks = await asyncio.to_thread(
+            self._read, self._segment_path(key, index),
+            start - offset, end - offset + 1, chunk_size
+        )
+        if (key, index) in self._segments:
+            self._segments.move_to_end((key, index))
+        self.hits += 1
+        self.bytes_served += end - start + 1
+        return chunks
+
+    # Fill
+
+    async def set_meta(self, key: str, total: int, content_type: str):
+        meta = {"key": key, "total": total, "content_type": content_type}
+        self._meta[key] = meta
+        await asyncio.to_thread(self._write_file, self._meta_path(key), orjson.dumps(meta))
+
+    async def write(self, key: str, index: int, data: bytes):
+        self.misses += 1
+        await asyncio.to_thread(self._write_file, self._segment_path(key, index), data)
+        old = self._segments.pop((key, index), None)
+        if old is None:
+            old = 0
+            self._track_segments[key] = self._track_segments.get(key, 0) + 1
+        self._segments[(key, index)] = len(data)
+        self._bytes += len(data) - old
+        self.bytes_written += len(data)
+        self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "tracks": len(self._meta),
+            "segments": len(self._segments),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "segment_size": self.segment_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "bytes_served": self.bytes_served,
+            "bytes_written": self.bytes_written,
+            "evictions": self.evictions,
+            "admissions": self.admissions,
+        }
+
+    # Disk layout
+
+    def _track_dir(self, key: str) -> str:
+        if not re.fullmatch(r"[A-Za-z0-9_-]{1,64}", key):
+            key = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, key)
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self._track_dir(key), "meta.json")
+
+    def _segment_path(self, key: str, index: int) -> str:
+        return os.path.join(self._track_dir(key), f"{index}.seg")
+
+    @staticmethod
+    def _read(path: str, start: int, stop: int, chunk_size: int) -> List[bytes]:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return [mm[i:min(i + chunk_size, stop)] for i in range(start, stop, chunk_size)]
+
+    @staticmethod
+    def _write_file(path: str, data: bytes):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # A temp file per write: concurrent fills of one segment must not share it
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _load(self):
+        """Rebuild the index from a previous run's files"""
+        for name in os.listdir(self.directory):
+            track_dir = os.path.join(self.directory, name)
+            try:
+                with open(os.path.join(track_dir, "meta.json"), "rb") as f:
+                    meta = orjson.loads(f.read())
+                key = meta.get("key", name)
+                self._meta[key] = meta
+                for seg in os.listdir(track_dir):
+                    if seg.endswith(".seg"):
+                        size = os.path.getsize(os.path.join(track_dir, seg))
+                        self._segments[(key, int(seg[:-4]))] = size
+                        self._track_segments[key] = self._track_segments.get(key, 0) + 1
+                        self._bytes += size
+            except (OSError, ValueError):
+                continue
+            if key not in self._track_segments:
+                self._track_segments[key] = 0
+                self._forget(key)
+        self._evict()
+
+    def _evict(self):
+        while self._segments and self._bytes > self.max_bytes:
+            (key, index), size = self._segments.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._segment_path(key, index))
+            except OSError:
+                pass
+            self._track_segments[key] -= 1
+            if not self._track_segments[key]:
+                self._forget(key)
+
+    def _forget(self, key: str):
+        """Drop a track with no cached segments left; it must be re-admitted"""
+        del self._track_segments[key]
+        self._meta.pop(key, None)
+        track_dir = self._track_dir(key)
+        try:
+            os.remove(os.path.join(track_dir, "meta.json"))
+            os.rmdir(track_dir)
+        except OSError:
+            pass
@@ -0,0 +1,70 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls that share a key into one in-flight task.
+
+    The first caller for a key starts the work; callers arriving while it
+    is still running await the same task. Results and errors are delivered
+    to every waiter but never remembered, so the next call after completion
+    starts fresh. A waiter being cancelled does not cancel the shared task
+    unless it was the last one waiting on it.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self.calls = 0
+        self.collapsed = 0
+        self.errors = 0
+        self.abandoned = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task: self._finish(key, call))
+            self.calls += 1
+        else:
+            self.collapsed += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Nobody is left to receive the result. Forget the call
+                # first, so a caller arriving before the task has finished
+                # cancelling starts fresh instead of joining it.
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                call.task.cancel()
+                self.abandoned += 1
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.calls + self.collapsed
+        return {
+            "in_flight": len(self._calls),
+            "calls": self.calls,
+            "collapsed": self.collapsed,
+            "collapse_ratio": round(self.collapsed / total, 3) if total else 0.0,
+            "errors": self.errors,
+            "abandoned": self.abandoned,
+        }
+
+    def _finish(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.task.cancelled() and call.task.exception() is not None:
+            self.errors += 1
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+import time
+import zlib
+from typing import Any, Callable, Dict, Optional
+
+import orjson
+
+from cache import SharedCache
+
+log = logging.getLogger("khokho.snapshot")
+
+SNAPSHOT_VERSION = 1
+
+
+class CacheSnapshot:
+    """
+    Periodic on-disk copy of in-memory caches, for warm restarts.
+
+    The file is zlib-compressed JSON holding each cache's servable entries
+    with their absolute expiry, plus any extra data the caller passes to
+    `save()`. It is written to a temporary file and renamed into place, so
+    a crash mid-write leaves the previous snapshot intact.
+
+    `load()` parses the file in a thread, then restores entries on the
+    event loop in small slices so requests keep flowing meanwhile. Expired
+    entries are dropped and keys that are already cached are left alone.
+    """
+
+    def __init__(self, path: str, caches: Dict[str, SharedCache], chunk: int = 500):
+        self.path = path
+        self.caches = caches
+        self.chunk = chunk
+        self.saves = 0
+        self.restored = 0
+        self.skipped = 0
+        self.last_save: Optional[float] = None
+        self.last_save_bytes = 0
+
+    async def save(self, extra: Optional[Dict[str, Any]] = None):
+        # Only the entry list is built on the loop; encoding happens in a thread
+        payload = {
+            "version": SNAPSHOT_VERSION,
+            "saved": time.time(),
+            "caches": {name: cache.local.entries() for name, cache in self.caches.items()},
+            "extra": extra or {},
+        }
+        size = await asyncio.to_thread(self._write, payload)
+        self.saves += 1
+        self.last_save = payload["saved"]
+        self.last_save_bytes = size
+
+    def _write(self, payload: Dict[str, Any]) -> int:
+        data = zlib.compress(orjson.dumps(payload), 3)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        return len(data)
+
+    async def load(self, on_restore: Optional[Dict[str, Callable[[str, Any], None]]] = None) -> Dict[str, Any]:
+        """Restore the caches from disk; returns the snapshot's extra data"""
+        try:
+            payload = await asyncio.to_thread(self._read)
+        except FileNotFoundError:
+            return {}
+        except (OSError, zlib.error, orjson.JSONDecodeError) as e:
+            log.warning("ignoring unreadable cache snapshot", extra={"path": self.path, "error": repr(e)})
+            return {}
+        if payload.get("version") != SNAPSHOT_VERSION:
+            return {}
+
+        on_restore = on_restore or {}
+        for name, entries in payload.get("caches", {}).items():
+            cache = self.caches.get(name)
+            if cache is None:
+                continue
+            callback = on_restore.get(name)
+            # Most recently used first, since restore() prepends
+            entries.reverse()
+            for start in range(0, len(entries), self.chunk):
+                now = time.time()
+                for key, value, expires in entries[start:start + self.chunk]:
+                    if now >= expires + cache.local.stale_ttl:
+                        self.skipped += 1
+                        continue
+                    if cache.decode is not None:
+                        value = cache.decode(value)
+                    if cache.local.restore(key, value, expires):
+                        self.restored += 1
+                        if callback is not None:
+                            callback(key, value)
+                    else:
+                        self.skipped += 1
+                await asyncio.sleep(0)
+
+        log.info("restored cache snapshot", extra={
+            "restored": self.restored, "skipped": self.skipped,
+            "age": round(time.time() - payload.get("saved", 0)),
+        })
+        return payload.get("extra", {})
+
+    def _read(self) -> Dict[str, Any]:
+        with open(self.path, "rb") as f:
+            return orjson.loads(zlib.decompress(f.read()))
+
+    async def run(self, interval: float, extra: Callable[[], Dict[str, Any]] = dict):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.save(extra())
+            except Exception as e:
+                log.warning("cache snapshot failed", extra={"path": self.path, "error": repr(e)})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "saves": self.saves,
+            "last_save": self.last_save,
+            "last_save_bytes": self.last_save_bytes,
+            "restored": self.restored,
+            "skipped": self.skipped,
+        }
@@ -0,0 +1,26 @@
+from models import Track
+from recommend import Recommender
+
+
+def _track(n: int) -> Track:
+    return Track(videoId=f"v{n}", title=f"Song {n}", artists=[{"name": f"Artist {n % 50}"}],
+                 album={}, duration=200, duration_seconds=200, thumbnails=[],
+                 isExplicit=False, year=None)
+
+
+def test_compaction_is_incremental_and_keeps_edges_symmetric():
+    rec = Recommender(max_tracks=1000, max_edges=8, compact_step=20)
+    for page in range(300):
+        rec.observe_list([_track((page * 7 + k) % 3000) for k in range(20)])
+        assert len(rec._dropping) <= 100  # one tenth, worked off in steps
+
+    assert rec.compactions > 0
+    assert len(rec._index) <= 1100
+    for i, edges in enumerate(rec._edges):
+        if rec._tracks[i] is None:
+            assert not edges
+        for j in edges:
+            assert rec._tracks[j] is not None
+            assert i in rec._edges[j]
+    assert all(rec._tracks[i].videoId == v for v, i in rec._index.items())
+    assert rec.related("v10", 5) or "v10" not in rec._index
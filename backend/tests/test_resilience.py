@@ -0,0 +1,23 @@
+import asyncio
+import time
+
+from resilience import TokenBucket
+
+
+def test_concurrent_acquire_is_rate_limited():
+    bucket = TokenBucket(max_rate=50, burst=100)
+    bucket._tokens = 0  # drained
+
+    async def burst():
+        return await asyncio.gather(*(bucket.acquire(max_wait=0.5) for _ in range(500)))
+
+    started = time.monotonic()
+    granted = sum(asyncio.run(burst()))
+    elapsed = time.monotonic() - started
+
+    assert 24 <= granted <= 26  # 0.5 s of refill at 50/s
+    assert elapsed >= 0.45
+    assert bucket.throttled == 500 - granted
+    # The debt is paid off by the time the last waiter is through
+    bucket._refill()
+    assert bucket._tokens > -1
@@ -0,0 +1,40 @@
+import asyncio
+import os
+
+from segment_cache import SegmentCache
+
+
+def test_concurrent_writes_of_one_segment(tmp_path):
+    cache = SegmentCache(str(tmp_path), segment_size=1024, max_bytes=1024 * 1024)
+    data = os.urandom(1024)
+
+    async def fill():
+        await cache.set_meta("B1", 4096, "audio/mpeg")
+        await asyncio.gather(*(cache.write("B1", 0, data) for _ in range(8)))
+
+    asyncio.run(fill())
+
+    assert cache.has_segment("B1", 0)
+    assert cache.stats()["bytes"] == len(data)
+    track_dir = tmp_path / "B1"
+    assert sorted(os.listdir(track_dir)) == ["0.seg", "meta.json"]  # no temp files left behind
+    assert (track_dir / "0.seg").read_bytes() == data
+
+
+def test_evicting_last_segment_forgets_track(tmp_path):
+    cache = SegmentCache(str(tmp_path), segment_size=1024, max_bytes=2048, admit_after=2)
+
+    async def fill(key):
+        await cache.set_meta(key, 2048, "audio/mpeg")
+        await cache.write(key, 0, os.urandom(1024))
+        await cache.write(key, 1, os.urandom(1024))
+
+    asyncio.run(fill("B1"))
+    assert cache.is_admitted("B1")
+    asyncio.run(fill("B2"))  # pushes both of B1's segments out
+
+    assert cache.meta("B1") is None
+    assert not cache.is_admitted("B1")
+    assert not (tmp_path / "B1").exists()
+    assert cache.meta("B2") is not None
+    assert cache.stats()["tracks"] == 1
@@ -0,0 +1,45 @@
+import asyncio
+
+from singleflight import SingleFlight
+
+
+def test_caller_after_abandonment_starts_fresh():
+    flight = SingleFlight()
+    started = []
+
+    async def work():
+        started.append(1)
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            await asyncio.sleep(0.05)  # slow to wind down
+            raise
+        return "fresh"
+
+    async def scenario():
+        first = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0.01)
+        first.cancel()  # the only waiter leaves; the shared task is cancelled
+        await asyncio.sleep(0)
+        # Arrives while the abandoned task is still cancelling
+        return await flight.do("k", work)
+
+    assert asyncio.run(scenario()) == "fresh"
+    assert len(started) == 2
+    assert flight.abandoned == 1
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do("k", work) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == [1] * 5
+    assert flight.collapsed == 4
@@ -12,6 +12,7 @@ export default function ArtistPage({ params: paramsPromise }) {
     const id = params.id;
     const [artist, setArtist] = useState(null);
     const [loading, setLoading] = useState(true);
+    const [loadingMore, setLoadingMore] = useState(null);
 
     useEffect(() => {
         const fetchArtist = async () => {
@@ -28,6 +29,35 @@ export default function ArtistPage({ params: paramsPromise }) {
         fetchArtist();
     }, [id]);
 
+    // Songs and albums arrive one page at a time; "next" is the cursor for the rest
+    const loadMore = async (section) => {
+        const cursor = artist?.[section]?.next;
+        if (!cursor || loadingMore) return;
+        setLoadingMore(section);
+        try {
+            const res = await fetch(`${API_URL}/artist/${id}?section=${section}&cursor=${encodeURIComponent(cursor)}`);
+            const page = await res.json();
+            setArtist(prev => ({
+                ...prev,
+                [section]: { ...prev[section], results: [...prev[section].results, ...page.results], next: page.next },
+            }));
+        } catch (err) {
+            console.error(err);
+        } finally {
+            setLoadingMore(null);
+        }
+    };
+
+    const moreButton = (section) => artist?.[section]?.next && (
+        <button
+            onClick={() => loadMore(section)}
+            disabled={loadingMore === section}
+            style={{ marginTop: '16px', background: 'rgba(255,255,255,0.08)', border: 'none', color: 'white', borderRadius: '20px', padding: '8px 20px', fontWeight: 700, cursor: 'pointer' }}
+        >
+            {loadingMore === section ? 'Loading...' : 'Show more'}
+        </button>
+    );
+
     if (loading) {
         return (
             <div style={{ padding: '24px' }}>
@@ -69,6 +99,7 @@ export default function ArtistPage({ params: paramsPromise }) {
                     <section style={{ marginBottom: '40px' }}>
                         <h2 style={{ fontSize: '1.5rem', fontWeight: 700, marginBottom: '20px' }}>Popular</h2>
                         <MusicList items={artist.songs.results} />
+                        {moreButton('songs')}
                     </section>
                 )}
 
@@ -77,6 +108,7 @@ export default function ArtistPage({ params: paramsPromise }) {
                     <section>
                         <h2 style={{ fontSize: '1.5rem', fontWeight: 700, marginBottom: '20px' }}>Albums</h2>
                         <MusicGrid items={artist.albums.results.map(a => ({ ...a, title: a.title, thumbnails: a.thumbnails }))} title="" />
+                        {moreButton('albums')}
                     </section>
                 )}
             </div>
@@ -1,5 +1,5 @@
 "use client";
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import MusicGrid from '@/components/MusicGrid';
 import MusicList from '@/components/MusicList';
 import { ListSkeleton, CardSkeleton } from '@/components/Skeleton';
@@ -18,6 +18,9 @@ export default function SearchPage() {
     const [categories, setCategories] = useState([]);
     const [suggestions, setSuggestions] = useState({ queries: [], results: [] });
     const { isMobile, isLoaded } = useDevice();
+    // Lets the backend cancel the upstream call of a search this one replaces
+    const sessionRef = useRef(null);
+    if (!sessionRef.current) sessionRef.current = Math.random().toString(36).slice(2);
 
     useEffect(() => {
         if (qParam) setQuery(qParam);
@@ -44,25 +47,56 @@ export default function SearchPage() {
             return;
         }
 
+        const controller = new AbortController();
+        const { signal } = controller;
+
         const debounce = setTimeout(async () => {
             setLoading(true);
             try {
-                const sugRes = await fetch(`${API_URL}/suggestions?q=${encodeURIComponent(query)}`);
-                const sugData = await sugRes.json();
-                setSuggestions(sugData);
+                fetch(`${API_URL}/suggestions?q=${encodeURIComponent(query)}`, { signal })
+                    .then(res => res.json())
+                    .then(setSuggestions)
+                    .catch(() => {});
 
-                const res = await fetch(`${API_URL}/search?q=${encodeURIComponent(query)}`);
-                const data = await res.json();
-                setResults(data);
+                // Results stream in as NDJSON: one track per line, then {"event": "done"}
+                const res = await fetch(
+                    `${API_URL}/search?q=${encodeURIComponent(query)}&session=${sessionRef.current}`,
+                    { headers: { Accept: 'application/x-ndjson' }, signal }
+                );
+                const reader = res.body.getReader();
+                const decoder = new TextDecoder();
+                const tracks = [];
+                let buffer = '';
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    const lines = buffer.split('\n');
+                    buffer = lines.pop();
+                    const before = tracks.length;
+                    for (const line of lines) {
+                        if (!line.trim()) continue;
+                        const item = JSON.parse(line);
+                        if (!item.event) tracks.push(item);
+                    }
+                    if (tracks.length !== before) {
+                        setResults([...tracks]);
+                        setLoading(false);
+                    }
+                }
+                setResults([...tracks]);
                 setSearched(true);
             } catch (err) {
-                console.error("Search failed", err);
+                if (err.name !== 'AbortError') console.error("Search failed", err);
             } finally {
-                setLoading(false);
+                if (!signal.aborted) setLoading(false);
             }
-        }, 500);
+        }, 300);
 
-        return () => clearTimeout(debounce);
+        return () => {
+            clearTimeout(debounce);
+            controller.abort();
+        };
     }, [query]);
 
     if (!isLoaded) return <div style={{ backgroundColor: 'var(--background)', minHeight: '100vh' }} />;
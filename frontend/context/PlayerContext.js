@@ -68,9 +68,35 @@ export function PlayerProvider({ children }) {
         }
     }, [volume]);
 
+    // Plays go through the backend, which batches them into Supabase;
+    // fall back to a direct insert if it isn't configured for that. Both
+    // paths carry the same event_id, so a play the backend accepted but
+    // answered late is not stored twice
+    const recordPlay = async (play) => {
+        const entry = { ...play, event_id: crypto.randomUUID() };
+        try {
+            const { data: { session } } = await supabase.auth.getSession();
+            if (!session) return;
+            const res = await fetch(`${API_URL}/history`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Authorization': `Bearer ${session.access_token}`
+                },
+                body: JSON.stringify(entry),
+                keepalive: true
+            });
+            if (res.ok) return;
+        } catch (e) {
+            // fall through to the direct insert
+        }
+        const { error } = await supabase.from('history').insert({ user_id: user.id, ...entry });
+        if (error) console.error("History error", error);
+    };
+
     const fetchRelated = async (videoId) => {
         try {
-            const res = await fetch(`${API_URL}/related/${videoId}`);
+            const res = await fetch(`${API_URL}/related/${videoId}?prefetch=3`);
             if (!res.ok) return [];
             return await res.json();
         } catch (e) {
@@ -145,13 +171,12 @@ export function PlayerProvider({ children }) {
                 setIsPlaying(true);
 
                 if (user) {
-                    supabase.from('history').insert({
-                        user_id: user.id,
+                    recordPlay({
                         video_id: id,
                         title: newSong.title,
                         artist: artistName,
                         thumbnail: getThumbnail(newSong)
-                    }).catch(err => console.error("History error", err));
+                    });
                 }
             }
         } catch (e) {
@@ -229,13 +254,12 @@ export function PlayerProvider({ children }) {
                     setIsPlaying(true);
 
                     if (user) {
-                        supabase.from('history').insert({
-                            user_id: user.id,
+                        recordPlay({
                             video_id: id,
                             title: data.title || song.title,
                             artist: artistName,
                             thumbnail: data.thumbnail || (getThumbnail(song) || "")
-                        }).catch(err => console.error(err));
+                        });
                     }
                 }
             })
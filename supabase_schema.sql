@@ -80,3 +80,7 @@ create policy "Users can manage items in their own playlists"
 alter publication supabase_realtime add table favorites;
 alter publication supabase_realtime add table playlists;
 alter publication supabase_realtime add table playlist_items;
+
+-- Plays recorded through the backend's /history endpoint are batched and
+-- retried; event_id lets a retried batch skip rows that already landed
+alter table history add column if not exists event_id uuid unique;